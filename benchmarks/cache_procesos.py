@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Revisa que la cache de tablas parseadas (CacheParseo) escrita por un proceso se pueda leer desde otro que cargo
+# stocks.py con otro nombre de modulo: `stocks` (import stocks), `__mp_main__` (como los procesos de parseo del
+# screener) o `__main__` (./stocks.py --offline sobre los fixtures, con y sin procesos de parseo). Cada caso pasa
+# los fixtures por la cache en un proceso y de nuevo en otro; en el segundo todos deben salir de la cache, y las
+# tablas leidas deben ser iguales a parsearlas de nuevo. Sale con error si algun caso falla.
+#
+#   python benchmarks/cache_procesos.py [-d directorio de fixtures]
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from grabar import archivos, fixtures
+from suite import cargar_fixtures, llenar_cache
+
+raiz = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+script = os.path.join(raiz, 'stocks.py')
+
+# (quien escribe, quien lee): un nombre de modulo, o el screener de stocks.py sin (__main__) o con procesos de parseo
+casos = [ ('__mp_main__', 'stocks'), ('stocks', '__mp_main__'), ('__main__', 'stocks'), ('stocks', '__main__'),
+    ('procesos', '__main__'), ('procesos', 'stocks') ]
+
+
+# stocks.py cargado como `nombre`, igual que lo hacen python, multiprocessing (spawn) o import
+def cargar_stocks(nombre):
+    spec = importlib.util.spec_from_file_location(nombre, script)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+# en el proceso hijo: pasa cada fixture por la cache e imprime cuantos se reutilizaron y cuantos salieron distintos
+# de parsearlos de nuevo
+def hijo(nombre, directorio, cache):
+    stocks = cargar_stocks(nombre)
+    stocks.cache_parseo = stocks.CacheParseo(os.path.join(cache, 'parseados'))
+    huella = lambda valor: hashlib.sha256(pickle.dumps(stocks.como_datos(valor))).hexdigest()
+    distintos = 0
+    for ticker in sorted(os.listdir(directorio)):
+        for documento, archivo in archivos.items():
+            with open(os.path.join(directorio, ticker, archivo), 'rb') as f:
+                contenido = f.read()
+            clave = stocks.clave_parseo(ticker, 'Annual', documento)
+            valor, _ = stocks.cache_parseo.parsear(documento, clave, contenido, stocks.lectores[documento])
+            distintos += huella(valor) != huella(stocks.lectores[documento](contenido))
+    print(json.dumps({ 'reutilizados': sum(stocks.cache_parseo.reutilizados.values()), 'distintos': distintos }))
+
+
+# (documentos reutilizados, distintos) de pasar los fixtures por la cache en un proceso de `quien`
+def correr(quien, directorio, cache, tickers):
+    if quien not in ('__main__', 'procesos'):
+        comando = [ sys.executable, os.path.abspath(__file__), '--hijo', quien, '-d', directorio, '--cache', cache ]
+        salida = json.loads(subprocess.run(comando, cwd=raiz, capture_output=True, text=True, check=True).stdout)
+        return salida['reutilizados'], salida['distintos']
+
+    # el screener imprime "documentos: N reutilizados, M parseados"; las tablas que deja se comparan al leerlas un hijo
+    comando = [ sys.executable, script, '--tickers', ','.join(tickers), '--offline', '--parse-workers',
+        '1' if quien == 'procesos' else '0' ]
+    entorno = dict(os.environ, BRATTIA_CACHE=cache, BRATTIA_DB=os.path.join(cache, 'estados.sqlite'), MPLBACKEND='Agg')
+    salida = subprocess.run(comando, cwd=raiz, env=entorno, capture_output=True, text=True, check=True).stdout
+    return int(re.search(r'documentos: (\d+) reutilizados', salida).group(1)), 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="cache_procesos.py", epilog="Parse cache shared between processes")
+    parser.add_argument('-d', action='store', metavar='DIR', default=fixtures, help='Fixtures directory (default: benchmarks/fixtures)')
+    parser.add_argument('--hijo', action='store', metavar='MODULO', help=argparse.SUPPRESS)
+    parser.add_argument('--cache', action='store', metavar='DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        hijo(args.hijo, args.d, args.cache)
+        sys.exit(0)
+
+    documentos = cargar_fixtures(args.d)
+    if not documentos:
+        sys.exit('no hay fixtures en ' + args.d + ', grabarlos con benchmarks/grabar.py')
+    total = len(documentos) * len(archivos)
+
+    fallidos = []
+    for escribe, lee in casos:
+        cache = tempfile.mkdtemp(prefix='brattia-cache-')
+        try:
+            # la cache http con los fixtures, para stocks.py --offline
+            llenar_cache(cache, documentos)
+            correr(escribe, args.d, cache, documentos)
+            reutilizados, distintos = correr(lee, args.d, cache, documentos)
+        except subprocess.CalledProcessError as e:
+            reutilizados, distintos = 0, 0
+            print(e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e))
+        finally:
+            shutil.rmtree(cache, ignore_errors=True)
+        bien = reutilizados == total and distintos == 0
+        print((escribe + ' -> ' + lee).ljust(26) + str(reutilizados) + '/' + str(total) + ' reutilizados'
+            + (', ' + str(distintos) + ' distintos' if distintos else '') + ('' if bien else '  FALLA'))
+        if not bien:
+            fallidos.append(escribe + ' -> ' + lee)
+
+    if fallidos:
+        sys.exit(1)
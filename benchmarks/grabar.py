@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Graba los documentos de algunas empresas como fixtures para benchmarks/suite.py, reemplazando los sinteticos
+# que vienen en el repositorio.
+#
+# Descarga sin cache los estados BAL/INC/CAS, la pagina de la accion, la de ratios y el EPS de
+# bolsadesantiago, y los guarda en fixtures/<TICKER>/ con los nombres BAL.html, INC.html, CAS.html,
+# precio.html, ratios.html y eps.json.
+#
+#   python benchmarks/grabar.py AAPL CCU SMU [-d directorio]
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stocks
+
+# documento de descargar_documentos -> archivo del fixture
+archivos = {
+    'BAL':    'BAL.html',
+    'INC':    'INC.html',
+    'CAS':    'CAS.html',
+    'ratios': 'ratios.html',
+    'precio': 'precio.html',
+    'eps':    'eps.json',
+}
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="grabar.py", epilog="Record benchmark fixtures")
+    parser.add_argument('tickers', nargs='+', help='Stocks to record, as in empresas.csv')
+    parser.add_argument('-d', action='store', metavar='DIR', default=fixtures, help='Fixtures directory (default: benchmarks/fixtures)')
+    args = parser.parse_args()
+
+    # cache vacia y TTL 0: todo sale de la red
+    with tempfile.TemporaryDirectory() as directorio:
+        cache = stocks.CacheHttp(directorio, ttl={ tipo: 0 for tipo in archivos })
+        for ticker in args.tickers:
+            # descargar_documentos lanza el error del primer documento que falla, se informa y se sigue con la siguiente
+            try:
+                documentos = stocks.cliente_http.ejecutar(lambda client: stocks.descargar_documentos(ticker, 'Annual', client, cache))
+            except stocks.ErrorDescarga as e:
+                print(ticker + ': no se grabo -> ' + type(e).__name__ + ': ' + str(e))
+                continue
+
+            os.makedirs(os.path.join(args.d, ticker), exist_ok=True)
+            for documento, archivo in archivos.items():
+                with open(os.path.join(args.d, ticker, archivo), 'wb') as f:
+                    f.write(documentos[documento])
+            print(ticker + ': ' + str(sum(len(c) for c in documentos.values())) + ' bytes')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Tiempo de parseo por tipo de documento para cada motor html disponible.
+#
+# Usa los documentos guardados en la cache http (ver CacheHttp en stocks.py), o los de un directorio
+# con archivos nombrados igual: BAL_*, INC_*, CAS_*, ratios_*, precio_*.
+#
+#   python benchmarks/parsers.py [directorio] [-r repeticiones]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stocks
+from bs4 import BeautifulSoup
+
+
+# parseo de cada tipo de documento, tal como lo hace Estados
+lectores = {
+    'BAL':    stocks.leer_tabla_estado,
+    'INC':    stocks.leer_tabla_estado,
+    'CAS':    stocks.leer_tabla_estado,
+    'ratios': stocks.leer_ratios,
+    'precio': stocks.leer_precio,
+}
+
+
+def cargar_documentos(directorio):
+    documentos = {}
+    for nombre in sorted(os.listdir(directorio)):
+        tipo = nombre.split('_')[0].split('.')[0]
+        if tipo in lectores:
+            with open(os.path.join(directorio, nombre), 'rb') as f:
+                documentos.setdefault(tipo, []).append(f.read())
+    return documentos
+
+
+# mediana en milisegundos de parsear un documento
+def medir(funcion, documentos, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        for documento in documentos:
+            inicio = time.perf_counter()
+            funcion(documento)
+            tiempos.append(time.perf_counter() - inicio)
+    return 1000 * statistics.median(tiempos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="parsers.py", epilog="HTML parser benchmark")
+    parser.add_argument('directorio', nargs='?', default=stocks.cache_http.directorio, help='Documents directory (default: the http cache)')
+    parser.add_argument('-r', action='store', metavar='N', type=int, default=5, help='Repetitions per document (default: 5)')
+    args = parser.parse_args()
+
+    documentos = cargar_documentos(args.directorio)
+    if not documentos:
+        sys.exit('no hay documentos en ' + args.directorio + ', ejecutar antes stocks.py para llenar la cache')
+
+    motores = stocks.motores_disponibles()
+    print('tipo'.ljust(8) + 'docs'.rjust(6) + 'completo'.rjust(14) + ''.join(m.rjust(14) for m in motores) + '   (ms por documento)')
+    for tipo, docs in documentos.items():
+        # referencia: html.parser sobre la pagina completa, como antes de usar SoupStrainer
+        completo = medir(lambda d: BeautifulSoup(d, 'html.parser').find_all('td' if tipo != 'precio' else 'span'), docs, args.r)
+        tiempos = [ medir(lambda d, m=m: lectores[tipo](d, m), docs, args.r) for m in motores ]
+        print(tipo.ljust(8) + str(len(docs)).rjust(6) + ('%.2f' % completo).rjust(14) + ''.join(('%.2f' % t).rjust(14) for t in tiempos))
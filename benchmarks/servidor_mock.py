@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Servidor local que imita las rutas de investing.com y bolsadesantiago que usa stocks.py, para probar
+# concurrencia y pool de conexiones sin cargar los sitios reales:
+#
+#   GET  /instruments/Financials/changereporttypeajax?pair_ID=<id>&report_type=BAL|INC|CAS
+#   GET  /equities/<slug>            pagina de la accion (precio)
+#   GET  /equities/<slug>-ratios     pagina de ratios
+#   POST /api/RV_Instrumentos/getRazonesFinancieras   {"nemo": <ticker>, ...}
+#
+# Responde con los fixtures de benchmarks/fixtures; una empresa del registro (empresas.csv) sin fixture usa siempre el
+# mismo fixture de otra (elegido por su nombre), asi se puede hacer el screener de todo el universo.
+# Latencia, jitter, tasa de errores (500) y limite de pedidos por segundo (429 con Retry-After) configurables;
+# con la misma semilla los errores se repiten igual. Con --price-walk el precio de cada empresa cambia al azar en
+# cada consulta, para probar stocks.py --watch.
+#
+#   python benchmarks/servidor_mock.py [-p 8000] [--latency 80] [--jitter 40] [--error-rate 0.02] [--rate 50] [--price-walk 0.05]
+#   BRATTIA_CACHE=$(mktemp -d) ./stocks.py --all --base-url http://127.0.0.1:8000
+
+import argparse
+import collections
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import stocks
+from grabar import fixtures
+from suite import cargar_fixtures
+
+
+class ServidorMock(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # el screener abre muchas conexiones a la vez; con la cola por defecto (5) el kernel descarta SYN
+    request_queue_size = 128
+
+    def __init__(self, direccion, documentos, latencia=0.0, jitter=0.0, tasa_error=0.0, limite=None, semilla=0, variacion=0.0):
+        super().__init__(direccion, Pedido)
+        self.documentos = documentos
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_error = tasa_error
+        self.limite = limite
+        self.variacion = variacion
+        self.precios = {}
+        self.azar = random.Random(semilla)
+        self.candado = threading.Lock()
+        self.conteo = collections.Counter()
+        # limite de pedidos por segundo: ventana de un segundo
+        self.ventana = 0
+        self.pedidos_ventana = 0
+
+        self.por_id = { e.pair_id: ticker for ticker, e in stocks.empresas.items() }
+        self.por_slug = { e.slug: ticker for ticker, e in stocks.empresas.items() }
+
+
+    # fixture de una empresa: el propio o, si no hay, uno fijo segun su nombre
+    def fixture(self, ticker):
+        if ticker in self.documentos:
+            return self.documentos[ticker]
+        nombres = sorted(self.documentos)
+        return self.documentos[nombres[zlib.crc32(ticker.encode()) % len(nombres)]]
+
+
+    # pagina de la accion con el precio movido hasta +-variacion desde el anterior de la misma empresa
+    def precio(self, ticker, contenido):
+        patron = re.compile('(Último cierre</span>.*?<span>)([0-9.,]+)(</span>)'.encode(), re.S)
+        encontrado = patron.search(contenido)
+        if not self.variacion or encontrado is None:
+            return contenido
+        with self.candado:
+            base = self.precios.get(ticker, float(encontrado.group(2).replace(b'.', b'').replace(b',', b'.')))
+            self.precios[ticker] = base * (1 + self.azar.uniform(-self.variacion, self.variacion))
+            texto = '{:,.2f}'.format(self.precios[ticker]).replace(',', '_').replace('.', ',').replace('_', '.')
+        return contenido[:encontrado.start(2)] + texto.encode() + contenido[encontrado.end(2):]
+
+
+    # (demora en segundos, codigo http o None si se responde normal, segundos de Retry-After)
+    def decidir(self):
+        with self.candado:
+            ahora = int(time.time())
+            if ahora != self.ventana:
+                self.ventana, self.pedidos_ventana = ahora, 0
+            self.pedidos_ventana += 1
+            if self.limite is not None and self.pedidos_ventana > self.limite:
+                return 0.0, 429, 1
+            demora = max(0.0, self.latencia + self.azar.uniform(-self.jitter, self.jitter))
+            if self.azar.random() < self.tasa_error:
+                return demora, 500, None
+            return demora, None, None
+
+
+class Pedido(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+    def responder(self, codigo, contenido=b'', tipo='text/html; charset=utf-8', reintentar=None):
+        self.server.conteo[codigo] += 1
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(contenido)))
+        if reintentar is not None:
+            self.send_header('Retry-After', str(reintentar))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+
+    # (ticker, documento) de la ruta, o None si no es una ruta conocida
+    def ruta(self, cuerpo):
+        url = urllib.parse.urlsplit(self.path)
+        parametros = urllib.parse.parse_qs(url.query)
+        if self.command == 'GET' and url.path == '/instruments/Financials/changereporttypeajax':
+            ticker = self.server.por_id.get(parametros.get('pair_ID', [''])[0])
+            tipo = parametros.get('report_type', [''])[0]
+            return (ticker, tipo) if ticker and tipo in ('BAL', 'INC', 'CAS') else None
+        if self.command == 'GET' and url.path.startswith('/equities/'):
+            slug = url.path[len('/equities/'):]
+            if slug.endswith('-ratios') and slug[:-len('-ratios')] in self.server.por_slug:
+                return self.server.por_slug[slug[:-len('-ratios')]], 'ratios'
+            if slug in self.server.por_slug:
+                return self.server.por_slug[slug], 'precio'
+            return None
+        if self.command == 'POST' and url.path == '/api/RV_Instrumentos/getRazonesFinancieras':
+            try:
+                ticker = json.loads(cuerpo).get('nemo')
+            except ValueError:
+                return None
+            return (ticker, 'eps') if ticker in stocks.empresas else None
+        return None
+
+
+    def atender(self):
+        cuerpo = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        ruta = self.ruta(cuerpo)
+        if ruta is None:
+            self.responder(404, b'not found', 'text/plain')
+            return
+
+        demora, codigo, reintentar = self.server.decidir()
+        time.sleep(demora)
+        if codigo is not None:
+            self.responder(codigo, b'error', 'text/plain', reintentar)
+            return
+
+        ticker, documento = ruta
+        tipo = 'application/json' if documento == 'eps' else 'text/html; charset=utf-8'
+        contenido = self.server.fixture(ticker)[documento]
+        if documento == 'precio':
+            contenido = self.server.precio(ticker, contenido)
+        self.responder(200, contenido, tipo)
+
+
+    do_GET = atender
+    do_POST = atender
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="servidor_mock.py", epilog="Local investing.com / bolsadesantiago stand-in")
+    parser.add_argument('-p', '--port', action='store', type=int, default=8000, help='Port (default: 8000)')
+    parser.add_argument('-d', action='store', metavar='DIR', default=fixtures, help='Fixtures directory (default: benchmarks/fixtures)')
+    parser.add_argument('--latency', action='store', metavar='MS', type=float, default=0, help='Mean response latency in ms')
+    parser.add_argument('--jitter', action='store', metavar='MS', type=float, default=0, help='Latency varies uniformly by +- MS')
+    parser.add_argument('--error-rate', action='store', metavar='P', type=float, default=0, help='Fraction of requests answered with 500')
+    parser.add_argument('--rate', action='store', metavar='N', type=int, help='Requests per second before answering 429 with Retry-After')
+    parser.add_argument('--price-walk', action='store', metavar='F', type=float, default=0, help='Move each stock price by up to +-F (fraction) on every request')
+    parser.add_argument('--seed', action='store', type=int, default=0, help='Random seed for jitter and errors (default: 0)')
+    args = parser.parse_args()
+
+    documentos = cargar_fixtures(args.d)
+    if not documentos:
+        sys.exit('no hay fixtures en ' + args.d + ', grabarlos con benchmarks/grabar.py')
+
+    servidor = ServidorMock(('127.0.0.1', args.port), documentos, args.latency / 1000, args.jitter / 1000,
+        args.error_rate, args.rate, args.seed, args.price_walk)
+    print('sirviendo ' + ', '.join(documentos) + ' en http://127.0.0.1:' + str(args.port) + ' (ctrl-c para terminar)')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        print('')
+        print('respuestas: ' + ', '.join(str(codigo) + ': ' + str(n) for codigo, n in sorted(servidor.conteo.items())))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Tiempo de arranque en frio de stocks.py, como cuando el screener lo ejecuta una vez por empresa.
+#
+# Mide en procesos nuevos `import stocks` y `stocks.py -v`, y revisa que importar stocks no cargue
+# los modulos pesados que solo se usan al descargar, parsear o graficar. Sale con error si se pasa
+# del limite, para usarlo como guarda de regresion.
+#
+#   python benchmarks/startup.py [-r repeticiones] [--max-ms limite]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+raiz = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+script = os.path.join(raiz, 'stocks.py')
+
+# no deben estar cargados despues de `import stocks`
+modulos_diferidos = ('matplotlib', 'bs4', 'httpx', 'lxml', 'selectolax')
+
+casos = {
+    'import stocks': [ sys.executable, '-c', 'import stocks' ],
+    'stocks.py -v':  [ sys.executable, script, '-v' ],
+}
+
+
+# mediana en milisegundos de ejecutar el comando en un proceso nuevo
+def medir(comando, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run(comando, cwd=raiz, stdout=subprocess.DEVNULL, check=True)
+        tiempos.append(time.perf_counter() - inicio)
+    return 1000 * statistics.median(tiempos)
+
+
+def modulos_cargados():
+    codigo = 'import sys, stocks; print(" ".join(sorted(m for m in sys.modules if "." not in m)))'
+    salida = subprocess.run([ sys.executable, '-c', codigo ], cwd=raiz, capture_output=True, text=True, check=True).stdout
+    return [ m for m in salida.split() if m in modulos_diferidos ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="startup.py", epilog="Cold start benchmark")
+    parser.add_argument('-r', action='store', metavar='N', type=int, default=10, help='Runs per case (default: 10)')
+    parser.add_argument('--max-ms', action='store', metavar='MS', type=float, help='Fail if a case takes longer than MS')
+    args = parser.parse_args()
+
+    # referencia: el interprete solo
+    base = medir([ sys.executable, '-c', 'pass' ], args.r)
+    print('caso'.ljust(16) + 'ms'.rjust(10) + 'sin python'.rjust(12))
+    print('python'.ljust(16) + ('%.1f' % base).rjust(10) + ('%.1f' % 0).rjust(12))
+
+    lentos = []
+    for caso, comando in casos.items():
+        tiempo = medir(comando, args.r)
+        print(caso.ljust(16) + ('%.1f' % tiempo).rjust(10) + ('%.1f' % (tiempo - base)).rjust(12))
+        if args.max_ms is not None and tiempo > args.max_ms:
+            lentos.append(caso)
+
+    cargados = modulos_cargados()
+    print('')
+    print('modulos pesados cargados al importar stocks: ' + (', '.join(cargados) or 'ninguno'))
+
+    if lentos or cargados:
+        sys.exit(1)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmarks sin red sobre los documentos de benchmarks/fixtures. Los incluidos en el repositorio son sinteticos
+# (misma estructura que las paginas reales, valores inventados y tablas mucho mas chicas): los tiempos sirven para
+# comparar commits, no para estimar los de las paginas reales. grabar.py los reemplaza por paginas grabadas.
+#
+# Fases, cada una por separado y por empresa:
+#   parseo         html/json de los 6 documentos -> tablas
+#   extraccion     partidas de las tablas ya parseadas (partidas_empresa)
+#   estados        Estados con los documentos y todos sus campos, parseando todo
+#   estados_cache  lo mismo, reutilizando las tablas parseadas (CacheParseo)
+#   main           stocks.py -n <TICKER> --offline completo, en un proceso nuevo
+#
+# Para cada fase: mediana en ms y memoria maxima (tracemalloc en las fases del proceso, RSS maximo en main).
+# Con -o se guardan los resultados en json; con -c se comparan contra un json anterior (ej: de otro commit).
+#
+#   python benchmarks/suite.py [-r repeticiones] [-o actual.json] [-c anterior.json] [--parser motor]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+raiz = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, raiz)
+
+import stocks
+from grabar import archivos, fixtures
+
+
+def cargar_fixtures(directorio):
+    documentos = {}
+    for ticker in sorted(os.listdir(directorio)):
+        if ticker not in stocks.empresas:
+            continue
+        documentos[ticker] = {}
+        for documento, archivo in archivos.items():
+            with open(os.path.join(directorio, ticker, archivo), 'rb') as f:
+                documentos[ticker][documento] = f.read()
+    return documentos
+
+
+# mismos nombres de archivo que CacheHttp, para que stocks.py --offline lea los fixtures
+def llenar_cache(directorio, documentos):
+    cache = stocks.CacheHttp(directorio)
+    for ticker, docs in documentos.items():
+        stock_id, slug = stocks.get_id(ticker), stocks.get_slug(ticker)
+        for tipo in ('BAL', 'INC', 'CAS'):
+            cache.guardar(tipo, stock_id + '_Annual', docs[tipo])
+        cache.guardar('ratios', slug, docs['ratios'])
+        cache.guardar('precio', slug, docs['precio'])
+        cache.guardar('eps', ticker, docs['eps'])
+
+
+def parseo(docs):
+    return {
+        'BAL':    stocks.leer_tabla_estado(docs['BAL']),
+        'INC':    stocks.leer_tabla_estado(docs['INC']),
+        'CAS':    stocks.leer_tabla_estado(docs['CAS']),
+        'ratios': stocks.leer_ratios(docs['ratios']),
+        'precio': stocks.leer_precio(docs['precio']),
+        'eps':    json.loads(docs['eps']),
+    }
+
+
+def estados(ticker, docs):
+    b = stocks.Estados(ticker, 'Annual', 5, docs, almacen=None)
+    b.resolver()
+    return stocks.partidas_empresa(b)
+
+
+# prepara un Estados con las tablas ya parseadas, solo se mide la extraccion
+def preparar_extraccion(ticker, docs):
+    tablas = parseo(docs)
+    def extraccion():
+        b = stocks.Estados(ticker, 'Annual', 5, docs, almacen=None)
+        b.balances, b.resultados, b.flujos_caja = tablas['BAL'], tablas['INC'], tablas['CAS']
+        return stocks.partidas_empresa(b)
+    return extraccion
+
+
+# mediana en ms y pico de memoria en kB (en una pasada aparte, tracemalloc hace mas lenta la medicion)
+def medir(funcion, repeticiones):
+    with contextlib.redirect_stdout(io.StringIO()):
+        funcion()
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+
+        tracemalloc.start()
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return { 'ms': round(1000 * statistics.median(tiempos), 3), 'pico_kb': round(pico / 1024, 1) }
+
+
+# stocks.py completo en un proceso nuevo; la memoria es el RSS maximo del proceso
+def medir_main(ticker, entorno, graficos, repeticiones):
+    comando = [ sys.executable, os.path.join(raiz, 'stocks.py'), '-n', ticker, '--offline', '--charts', graficos ]
+    tiempos = []
+    picos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        proceso = subprocess.Popen(comando, env=entorno, stdout=subprocess.DEVNULL)
+        _, estado, uso = os.wait4(proceso.pid, 0)
+        tiempos.append(time.perf_counter() - inicio)
+        proceso.returncode = os.waitstatus_to_exitcode(estado)
+        if proceso.returncode != 0:
+            sys.exit('stocks.py -n ' + ticker + ' termino con codigo ' + str(proceso.returncode))
+        # ru_maxrss en kB en linux, en bytes en macos
+        picos.append(uso.ru_maxrss / 1024 if sys.platform == 'darwin' else uso.ru_maxrss)
+    return { 'ms': round(1000 * statistics.median(tiempos), 3), 'pico_kb': round(max(picos), 1) }
+
+
+def commit_actual():
+    try:
+        return subprocess.run([ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=raiz, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def imprimir(resultados, anterior=None):
+    print('fase'.ljust(16) + 'ticker'.ljust(10) + 'ms'.rjust(12) + 'pico kB'.rjust(12) + ('   vs anterior' if anterior else ''))
+    for fase, por_ticker in resultados['fases'].items():
+        for ticker, r in por_ticker.items():
+            linea = fase.ljust(16) + ticker.ljust(10) + ('%.3f' % r['ms']).rjust(12) + ('%.1f' % r['pico_kb']).rjust(12)
+            previo = (anterior or {}).get('fases', {}).get(fase, {}).get(ticker)
+            if previo:
+                linea += ('%+.1f %%' % (100 * (r['ms'] / previo['ms'] - 1))).rjust(14)
+            print(linea)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="suite.py", epilog="Offline benchmark suite")
+    parser.add_argument('-d', action='store', metavar='DIR', default=fixtures, help='Fixtures directory (default: benchmarks/fixtures)')
+    parser.add_argument('-r', action='store', metavar='N', type=int, default=10, help='Repetitions per phase (default: 10)')
+    parser.add_argument('--main-runs', action='store', metavar='N', type=int, default=3, help='Repetitions of the full stocks.py run (default: 3)')
+    parser.add_argument('--parser', action='store', choices=stocks.motores_disponibles(), default=stocks.motor_html, help='HTML parser engine')
+    parser.add_argument('-o', action='store', metavar='FILE', help='Write the results as json to FILE')
+    parser.add_argument('-c', action='store', metavar='FILE', help='Compare against the results of a previous run')
+    args = parser.parse_args()
+
+    stocks.motor_html = args.parser
+    documentos = cargar_fixtures(args.d)
+    if not documentos:
+        sys.exit('no hay fixtures en ' + args.d + ', grabarlos con benchmarks/grabar.py')
+
+    fases = { fase: {} for fase in ('parseo', 'extraccion', 'estados', 'estados_cache', 'main') }
+    temporal = tempfile.mkdtemp(prefix='brattia-bench-')
+    try:
+        for ticker, docs in documentos.items():
+            fases['parseo'][ticker] = medir(lambda: parseo(docs), args.r)
+            fases['extraccion'][ticker] = medir(preparar_extraccion(ticker, docs), args.r)
+
+            stocks.cache_parseo = stocks.CacheParseo(None)
+            fases['estados'][ticker] = medir(lambda: estados(ticker, docs), args.r)
+            stocks.cache_parseo = stocks.CacheParseo(os.path.join(temporal, 'parseados'))
+            fases['estados_cache'][ticker] = medir(lambda: estados(ticker, docs), args.r)
+
+        cache = os.path.join(temporal, 'cache')
+        llenar_cache(cache, documentos)
+        entorno = dict(os.environ, BRATTIA_CACHE=cache, BRATTIA_DB=os.path.join(temporal, 'estados.sqlite'), MPLBACKEND='Agg')
+        for ticker in documentos:
+            fases['main'][ticker] = medir_main(ticker, entorno, os.path.join(temporal, 'graficos'), args.main_runs)
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    resultados = {
+        'commit': commit_actual(),
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'parser': args.parser,
+        'repeticiones': args.r,
+        'fases': fases,
+    }
+
+    anterior = None
+    if args.c:
+        with open(args.c, encoding='utf-8') as f:
+            anterior = json.load(f)
+    imprimir(resultados, anterior)
+
+    if args.o:
+        with open(args.o, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
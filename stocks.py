@@ -2,16 +2,40 @@
 # -*- coding: utf-8 -*-
 # El objetivo de este script es utilizar investing.com para realizar el analisis fundamental de una empresa.
 
-import httpx
-import requests
+import asyncio
+import atexit
+import bisect
+import collections
+import collections.abc
+import contextlib
+import contextvars
+import csv
+import difflib
+import functools
+import hashlib
+import importlib.util
+import io
+import mmap
+import os
+import pickle
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import urllib.parse
 import json
 import numpy as np
 import argparse
-from bs4 import BeautifulSoup
 from colorama import Fore, Back, Style
-import matplotlib.pyplot as plt
 from datetime import date
 
+# httpx, bs4 y matplotlib se importan en las funciones que los usan: stocks.py -v o un analisis sin grafico
+# no pagan su carga (matplotlib sola toma cientos de ms). benchmarks/startup.py mide el tiempo de arranque.
+
 
 """
  Activos por ver:
@@ -21,86 +45,229 @@ from datetime import date
 """
 
 
-base_url = 'https://es.investing.com/instruments/Financials/changereporttypeajax?action=change_report_type&pair_ID='
-
-
-# id, slug
-empresas = {
-
-    "AAPL":           [ "6408", "apple-computer-inc" ],
-    "NVIDIA":         [ "6497", "nvidia-corp" ],
-    "MELI":           [ "16599", "mercadolibre" ],
-    "ENELCHILE":      [ "976489", "enersis-chile-sa" ],
-    "OXIQUIM":        [ "1036886", "oxiquim" ],
-    "ENELAM":         [ "41445", "enersis" ],
-    "SMU":            [ "1055339", "smu" ],
-    "MASISA":         [ "41468", "masisa" ],
-    "HABITAT":        [ "41452", "a.f.p.-habitat" ],
-    "ILC":            [ "41458", "inv-la-constru" ],
-    "AAISA":          [ "1193024", "administradora-americana-de-invers" ],
-    "CONCHATORO":     [ "41427", "vina-concha-to" ],
-    "SOQUICOM":       [ "41485", "soquicom" ],
-    "CCU":            [ "41417", "cervecerias-un" ],
-    "CLOROX":         [ "7933", "clorox-co" ],
-    "EMBONORB":       [ "41443", "embonor-b"],
-    "LIPIGAS":        [ "996053", "empresas-lipigas-sa"],
-    "NUEVAPOLAR":     [ "41462", "nuevapolar" ],
-    "QUINENCO":       [ "41481", "quinenco" ],
-    "PROVIDA":        [ "41480", "a.f.p.-provida" ],
-    "ZOFRI":          [ "41500", "zofri" ],
-    "ANDINA-A":       [ "41403", "emb-andina-a" ],
-    "AESANDES":       [ "41407", "aesgener" ],
-    "AGUAS-A":        [ "41402", "aguas-andinas" ],
-    "CHILE":          [ "41422", "banco-de-chile-(sn)" ],
-    "BCI":            [ "41412", "bci-(sn)" ],
-    "CAP":            [ "41415", "cap" ],
-    "CENCOSUD":       [ "41419", "cencosud" ],
-    "CENCOSHOPP":     [ "1152242", "cencosud-shopping-sa" ],
-    "COLBUN":         [ "41432", "colbun" ],
-    "ANDINA-B":       [ "41404", "emb-andina-b" ],
-    "BSANTANDER":     [ "41493", "santander-chil" ],
-    "CMPC":           [ "41416", "cmpc" ],
-    "COPEC":          [ "41434", "empresas-copec" ],
-    "FALABELLA":      [ "41449", "falabella" ],
-    "IAM":            [ "41455", "iam-sa" ],
-    "OROBLANCO":      [ "41471", "oro-blanco" ],
-    "RIPLEY":         [ "41482", "ripley-corp" ],
-    "SECURITY":       [ "41487", "grupo-security" ],
-    "SONDA":          [ "41489", "sonda" ],
-    "SQM-B":          [ "41491", "soquimich-b" ],
-    "LTM":            [ "41461", "latam-airlines" ],
-    "CAROZZI":        [ "1161680", "carozzi-sa" ],
-    "GASCO":          [ "41451", "gasco" ],
-    "CRISTALES":      [ "41435", "cristales" ],
-    "MALLPLAZA":      [ "1094237", "plaza" ],
-    "ENTEL":          [ "41447", "entel" ],
-    "ITAUCL":         [ "41431", "corpbanca-(sn)" ],
-    "VAPORES":        [ "41497", "vapores" ],
-    "PARAUCO":        [ "41472", "parq-arauco" ],
-    "ECL":            [ "41438", "ecl-sa"],
-}
+investing_origen = 'https://es.investing.com'
+bolsa_origen = 'https://www.bolsadesantiago.com:443'
+
+
+# todas las rutas bajo otro origen (ej: http://127.0.0.1:8000 de benchmarks/servidor_mock.py); sin url, los sitios reales.
+# Los documentos de otro origen no son los reales: su cache http, sus tablas parseadas y su historia en SQLite van a
+# un directorio propio dentro de la cache (origenes/<host_puerto>), asi una prueba contra el servidor mock no
+# reemplaza periodos de la base real ni deja paginas que despues se sirvan como si fueran de investing.com
+def usar_base_url(url=None):
+    global base_url, equities_url, eps_url
+    investing = url.rstrip('/') if url else investing_origen
+    bolsa = url.rstrip('/') if url else bolsa_origen
+    base_url = investing + '/instruments/Financials/changereporttypeajax?action=change_report_type&pair_ID='
+    equities_url = investing + '/equities/'
+    eps_url = bolsa + '/api/RV_Instrumentos/getRazonesFinancieras'
+
+    if url:
+        origen = re.sub(r'[^\w.-]', '_', urllib.parse.urlsplit(url).netloc or url)
+        cache_http.directorio = os.path.join(directorio_cache, 'origenes', origen)
+        almacen_estados.usar(os.path.join(cache_http.directorio, 'estados.sqlite'))
+    else:
+        cache_http.directorio = directorio_cache
+        almacen_estados.usar(ruta_base_datos)
+    cache_parseo.directorio = os.path.join(cache_http.directorio, 'parseados')
+
+eps_cookies = {"f5avraaaaaaaaaaaaaaaa_session_": "KOCJLNMPEKADJKFMOACMGBFKAGEPDLKDKPICKGLLONEBGKJLDAOLBJLEEPOLJLLDKLIDDJMIFIMKLJPHHBEACAJCBFAMBJPLPADKGOFEMKFCEODHMNIOGDDLDBGNNBIA", "__uzma": "2e55a4c4-edf7-47e3-bf44-132971d02b14", "__uzmb": "1712783997", "__uzme": "1588", "__uzmc": "3389815783307", "__uzmd": "1712806016", "gb-wbchtbt-uid": "1712784005666", "_csrf": "GEBGUKzB_IHm7-6V_5w_jNtl", "_ga": "GA1.2.1981571046.1712784007", "_gid": "GA1.2.674991874.1712784007", "_ga_Y647MRPM4Z": "GS1.2.1712805991.3.1.1712805991.60.0.0", "__gads": "ID=cad4a9546dad64cb:T=1712784012:RT=1712805983:S=ALNI_MaUktTczhSHoJGS2gRkceCo_7Cj3w", "__gpi": "UID=00000a1bcee3b07b:T=1712784012:RT=1712805983:S=ALNI_MZALrNNF6GkoMrZkzLQhutpDJX4OA", "__eoi": "ID=428dab9e8a7566f8:T=1712784012:RT=1712805983:S=AA-Afjb-MMmAJherJbZRQjv9PRNu", "BIGipServerPool-Push_HTML5_corporativa": "684715681.20480.0000", "BIGipServerPool-www.bolsadesantiago.com-HTML5_corporativa": "718270113.20480.0000", "FCNEC": "%5B%5B%22AKsRol_DlVkNSpdxhMAeR4p1ha_RfGHy3skOSDd2kUCRoIwX3fK2XRvx0cFC_8Euo-n4UK27ayGB5dBFSZ9B61ULHs6ch6sIQgAFUeBcRVRiGreDkhRYqWb1ZABOdDMJ3ZH-5EtvaT3y9f1CSbk-G6GFoNWTGU8CvA%3D%3D%22%5D%5D", "_oauth2_proxy_csrf": "gBTdOJQjqpWcLOdWS9B9CN2C1O52uiOmYmhRaxUvW8Rwb7nKfohbTSUfpA8y15xjfGAUdnxAIipM3KGypnrRyyBzn2yoqCcdatz0azJzUmpeytt52hWF6io=|1712805978|q45Ny1dpkMbKiHctitX2oL9V_P0J4R3AqII7vi-wLvc=", "_gat": "1"}
+eps_headers = {"User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/113.0", "Accept": "application/json, text/plain, */*", "Accept-Language": "en-US,en;q=0.5", "Accept-Encoding": "gzip, deflate", "Content-Type": "application/json;charset=utf-8", "X-Csrf-Token": "9Q0uqssK-1ews3xi41eCf2XMXKZtxB7OMfwg", "Origin": "https://www.bolsadesantiago.com", "Referer": "https://www.bolsadesantiago.com/resumen_instrumento/ZOFRI", "Sec-Fetch-Dest": "empty", "Sec-Fetch-Mode": "cors", "Sec-Fetch-Site": "same-origin", "Te": "trailers",
+               "Cookie": "; ".join(k + "=" + v for k, v in eps_cookies.items())}
+
+
+"""
+  Registro de empresas: ticker -> (pair_ID de investing.com, slug, bolsa, moneda, sector), leido de empresas.csv
+  (junto a stocks.py, o $BRATTIA_EMPRESAS) con una fila por empresa ordenada por ticker. Al importar no se lee nada:
+  un ticker suelto (stocks.py -n, cada proceso de parseo) se busca con busqueda binaria sobre el archivo mapeado en
+  memoria, sin leer las demas filas; el indice completo (dict, O(1)) se arma la primera vez que se recorre el
+  registro o se busca por prefijo, bolsa o sector. Si el archivo no esta ordenado la busqueda binaria puede fallar,
+  pero un ticker no encontrado siempre se confirma en el indice completo.
+"""
+Empresa = collections.namedtuple('Empresa', 'ticker pair_id slug bolsa moneda sector')
+
+
+# ticker que no esta en el registro; sugerencias: tickers parecidos (ej: APPL -> AAPL)
+class TickerDesconocido(KeyError):
+    def __init__(self, ticker, sugerencias=()):
+        super().__init__(ticker)
+        self.ticker = ticker
+        self.sugerencias = list(sugerencias)
+
+    def __str__(self):
+        return 'ticker desconocido: ' + self.ticker + (' (quizas ' + ', '.join(self.sugerencias) + ')' if self.sugerencias else '')
+
+
+class RegistroEmpresas(collections.abc.Mapping):
+    columnas = Empresa._fields
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.indice = None
+        self.sueltas = {}
+        self.candado = threading.Lock()
+
+
+    def leer_fila(self, fila, linea):
+        if len(fila) != len(self.columnas):
+            raise ValueError(self.ruta + ':' + str(linea) + ': se esperaban ' + str(len(self.columnas)) + ' columnas ('
+                + ','.join(self.columnas) + ')')
+        return Empresa(*(valor.strip() for valor in fila))
+
+
+    # indice completo: tickers ordenados para buscar por prefijo y tickers por bolsa y por sector
+    def cargar(self):
+        with self.candado:
+            if self.indice is not None:
+                return self.indice
+            indice = {}
+            with open(self.ruta, newline='', encoding='utf-8') as f:
+                lector = csv.reader(f)
+                next(lector, None)
+                for linea, fila in enumerate(lector, 2):
+                    if not fila:
+                        continue
+                    empresa = self.leer_fila(fila, linea)
+                    if empresa.ticker in indice:
+                        raise ValueError(self.ruta + ':' + str(linea) + ': ticker repetido ' + empresa.ticker)
+                    indice[empresa.ticker] = empresa
+
+            self.ordenados = sorted(indice)
+            self.por_bolsa = collections.defaultdict(list)
+            self.por_sector = collections.defaultdict(list)
+            for empresa in indice.values():
+                self.por_bolsa[empresa.bolsa.lower()].append(empresa.ticker)
+                self.por_sector[empresa.sector.lower()].append(empresa.ticker)
+            self.indice = indice
+            return indice
+
+
+    # busqueda binaria de la fila de un ticker en el archivo, sin leerlo completo; None si no esta
+    def buscar_en_archivo(self, ticker):
+        buscado = ticker.encode()
+        try:
+            with open(self.ruta, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                # la primera linea es el encabezado
+                bajo, alto = m.find(b'\n') + 1, len(m)
+                while 0 < bajo < alto:
+                    medio = (bajo + alto) // 2
+                    inicio = m.rfind(b'\n', bajo, medio) + 1 or bajo
+                    fin = m.find(b'\n', inicio)
+                    fin = len(m) if fin == -1 else fin
+                    linea = m[inicio:fin].rstrip(b'\r')
+                    clave = linea.split(b',', 1)[0].strip()
+                    if clave == buscado:
+                        return self.leer_fila(next(csv.reader([ linea.decode('utf-8') ])), None)
+                    if clave < buscado:
+                        bajo = fin + 1
+                    else:
+                        alto = inicio
+        except ValueError:
+            # archivo vacio (mmap no acepta largo 0) o fila mal formada: se decide con el indice completo
+            pass
+        return None
+
+
+    # la Empresa de un ticker, o None si no esta; antes de cargar el indice no se lee el archivo completo
+    def obtener(self, ticker):
+        if self.indice is None:
+            if ticker not in self.sueltas:
+                empresa = self.buscar_en_archivo(ticker)
+                if empresa is not None:
+                    self.sueltas[ticker] = empresa
+            if ticker in self.sueltas:
+                return self.sueltas[ticker]
+        return self.cargar().get(ticker)
+
+
+    def __getitem__(self, ticker):
+        empresa = self.obtener(ticker)
+        if empresa is None:
+            raise TickerDesconocido(ticker, self.parecidos(ticker))
+        return empresa
+
+
+    def __contains__(self, ticker):
+        return self.obtener(ticker) is not None
+
+
+    def __iter__(self):
+        return iter(self.cargar())
+
+
+    def __len__(self):
+        return len(self.cargar())
+
+
+    # tickers que empiezan con prefijo, en orden
+    def por_prefijo(self, prefijo):
+        self.cargar()
+        prefijo = prefijo.upper()
+        desde = bisect.bisect_left(self.ordenados, prefijo)
+        hasta = bisect.bisect_left(self.ordenados, prefijo + '\uffff')
+        return self.ordenados[desde:hasta]
+
+
+    # tickers con escritura parecida (difflib), para sugerir ante un ticker mal escrito
+    def parecidos(self, texto, n=3):
+        return difflib.get_close_matches(texto.upper(), self.cargar(), n, 0.6)
+
+
+    # empresas que coinciden con texto: primero por prefijo del ticker, luego las que lo contienen en el slug y al
+    # final las de ticker o slug parecido
+    def buscar(self, texto, n=10):
+        indice = self.cargar()
+        encontrados = list(self.por_prefijo(texto))
+        clave = texto.lower()
+        encontrados += [ t for t in self.ordenados if clave in indice[t].slug ]
+        por_slug = { e.slug: t for t, e in indice.items() }
+        encontrados += difflib.get_close_matches(texto.upper(), self.ordenados, n, 0.7)
+        encontrados += [ por_slug[s] for s in difflib.get_close_matches(clave, por_slug, n, 0.7) ]
+        return [ indice[t] for t in dict.fromkeys(encontrados) ][:n]
+
+
+    # tickers (por defecto todos, en el orden del registro) de alguna de las bolsas y alguno de los sectores;
+    # sin bolsas o sin sectores no se filtra por ese campo. Las mayusculas no importan.
+    def seleccionar(self, bolsas=None, sectores=None, tickers=None):
+        self.cargar()
+        tickers = list(self.indice) if tickers is None else tickers
+        for valores, por_valor in ((bolsas, self.por_bolsa), (sectores, self.por_sector)):
+            if valores:
+                aceptados = { t for v in valores for t in por_valor.get(v.lower(), ()) }
+                tickers = [ t for t in tickers if t in aceptados ]
+        return tickers
+
+
+    # valores distintos de una columna (ej: 'bolsa', 'sector'), para mostrar las opciones validas
+    def valores(self, columna):
+        return sorted({ getattr(e, columna) for e in self.cargar().values() })
+
+
+empresas = RegistroEmpresas(os.environ.get('BRATTIA_EMPRESAS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'empresas.csv')))
 
 # funciones auxiliares
 def get_slug(nombre):
-    return empresas[nombre][1]
+    return empresas[nombre].slug
 
 
 def get_id(nombre):
-    return empresas[nombre][0]
+    return empresas[nombre].pair_id
 
 
 def special_print(word, color):
-    print(Fore.GREEN + word) if color == 'GREEN' else  print(Fore.RED + word)
+    print(getattr(Fore, color) + word)
     print(Style.RESET_ALL)
 
 
+# condition: True, False o None si no hay datos para evaluarla (ver veredicto)
 def print_bool_result(condition):
-    special_print('Si', 'GREEN') if condition  else special_print('No', 'RED')
+    if condition is None:
+        special_print('Sin datos', 'YELLOW')
+    else:
+        special_print('Si', 'GREEN') if condition  else special_print('No', 'RED')
 
 
-def convert(balances):
-    # print(balances)
-    strNumber = balances.text.replace(",", ".").strip('%')
+def convertir_texto(texto):
+    strNumber = texto.strip().replace(",", ".").strip('%')
     result = float(0)
     try:
         result = float(strNumber)
@@ -110,67 +277,1408 @@ def convert(balances):
     return result
 
 
-def get_annual_data(balances, a,b,c,d):
-    return [ convert(balances[x]) for x in [a,b,c,d] ]
+# etiqueta en minusculas, sin tildes ni espacios repetidos
+def normalizar_etiqueta(etiqueta):
+    sin_tildes = unicodedata.normalize('NFKD', etiqueta).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(sin_tildes.lower().split())
+
+
+# fecha de cierre del periodo desde el encabezado de la tabla, ej: '2023 30/09'
+def fecha_periodo(texto):
+    anio = re.search(r'\b(\d{4})\b', texto)
+    dia_mes = re.search(r'\b(\d{1,2})/(\d{1,2})\b', texto)
+    if anio is None:
+        return None
+    if dia_mes is None:
+        return date(int(anio.group(1)), 12, 31)
+    return date(int(anio.group(1)), int(dia_mes.group(2)), int(dia_mes.group(1)))
+
+
+"""
+  Estado financiero (BAL/INC/CAS) leido una sola vez: una matriz float64 con una fila por partida
+  y una columna por periodo (el mas reciente primero), indexada por la etiqueta de la partida.
+"""
+class TablaEstado:
+    def __init__(self, periodos, etiquetas, valores):
+        self.periodos = periodos
+        self.etiquetas = etiquetas
+        self.valores = valores
+        self.indice = {}
+        for i, etiqueta in enumerate(etiquetas):
+            self.indice.setdefault(normalizar_etiqueta(etiqueta), i)
+
+
+    # la primera etiqueta (o alias) que exista en la tabla; una partida que no aparece vale `faltante` en todos los
+    # periodos: NaN (dato desconocido, los criterios que la usan quedan sin veredicto), o 0 para las partidas que
+    # una empresa puede no tener (inventario, acciones preferentes, dividendos)
+    def fila(self, *etiquetas, faltante=np.nan):
+        for etiqueta in etiquetas:
+            i = self.indice.get(normalizar_etiqueta(etiqueta))
+            if i is not None:
+                return self.valores[i]
+        return np.full(len(self.periodos), faltante)
+
+
+    def __contains__(self, etiqueta):
+        return normalizar_etiqueta(etiqueta) in self.indice
+
+
+    """
+      Suma de los ultimos `trimestres` periodos (trailing twelve months) para cada periodo de una tabla trimestral,
+      todas las partidas en una sola operacion con ventanas deslizantes. Solo tiene sentido para partidas de flujo
+      (ingresos, utilidad, FCF, EPS, dividendos). Una ventana cuyos trimestres no son consecutivos (falta uno en
+      el almacen) queda en NaN; los ultimos trimestres - 1 periodos no tienen ventana completa y no se incluyen.
+    """
+    def ttm(self, trimestres=4):
+        if len(self.periodos) < trimestres:
+            return TablaEstado([], self.etiquetas, np.empty((len(self.etiquetas), 0)))
+
+        sumas = np.lib.stride_tricks.sliding_window_view(self.valores, trimestres, axis=1).sum(axis=2)
+        # meses entre cierres: 3, con un margen de un mes para cierres como 01/07 en vez de 30/06
+        meses = np.array([ p.year * 12 + p.month if p is not None else np.nan for p in self.periodos ])
+        with np.errstate(invalid='ignore'):
+            seguidos = np.abs(-np.diff(meses) - 3) <= 1
+        consecutivos = np.lib.stride_tricks.sliding_window_view(seguidos, trimestres - 1).all(axis=1)
+        sumas[:, ~consecutivos] = np.nan
+        return TablaEstado(self.periodos[:sumas.shape[1]], self.etiquetas, sumas)
+
+
+    # agrega al final las columnas de `otra` anteriores al periodo mas antiguo de esta tabla (ej: los años del estado
+    # anual detras de los trimestres); las filas se alinean por etiqueta, NaN donde `otra` no tiene la partida
+    def extender(self, otra):
+        if None in self.periodos:
+            return self
+        antiguo = min(self.periodos) if self.periodos else date.max
+        columnas = [ j for j, p in enumerate(otra.periodos) if p is not None and p < antiguo ]
+        if not columnas:
+            return self
+
+        filas = np.array([ otra.indice.get(normalizar_etiqueta(e), -1) for e in self.etiquetas ], dtype=np.intp)
+        agregadas = np.full((len(self.etiquetas), len(columnas)), np.nan)
+        agregadas[filas >= 0] = otra.valores[filas[filas >= 0]][:, columnas]
+        return TablaEstado(self.periodos + [ otra.periodos[j] for j in columnas ], self.etiquetas,
+            np.hstack([ self.valores, agregadas ]))
+
+
+    # la misma tabla con las columnas de `periodos` (ej: los del balance), NaN en los periodos que no tiene
+    def en_periodos(self, periodos):
+        posicion = { p: j for j, p in enumerate(self.periodos) }
+        valores = np.full((len(self.etiquetas), len(periodos)), np.nan)
+        for k, p in enumerate(periodos):
+            if p in posicion:
+                valores[:, k] = self.valores[:, posicion[p]]
+        return TablaEstado(list(periodos), self.etiquetas, valores)
+
+
+"""
+  Motores de parseo html: 'html.parser' (puro python, siempre disponible), 'lxml' (via bs4) o 'selectolax'.
+  Con bs4 se usa SoupStrainer para construir solo las etiquetas que se leen (td, span o filas de la tabla),
+  el resto de la pagina se descarta durante el parseo.
+"""
+motor_html = 'html.parser'
+
+
+def motores_disponibles():
+    motores = ['html.parser']
+    # find_spec no ejecuta el modulo, solo revisa que este instalado
+    for motor, modulo in [('lxml', 'lxml'), ('selectolax', 'selectolax.lexbor')]:
+        try:
+            if importlib.util.find_spec(modulo) is not None:
+                motores.append(motor)
+        except ImportError:
+            pass
+    return motores
+
+
+# textos de todas las etiquetas `tag` del documento
+def textos_html(contenido, tag, motor=None):
+    motor = motor or motor_html
+    if motor == 'selectolax':
+        from selectolax.lexbor import LexborHTMLParser
+        return [ nodo.text() for nodo in LexborHTMLParser(contenido).css(tag) ]
+
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(contenido, motor, parse_only=SoupStrainer(tag))
+    return [ elemento.get_text() for elemento in soup.find_all(tag) ]
+
+
+# encabezados (th del thead) y filas (textos de las td hijas directas de cada tr) de una tabla
+def filas_html(contenido, motor=None):
+    motor = motor or motor_html
+    if motor == 'selectolax':
+        from selectolax.lexbor import LexborHTMLParser
+        arbol = LexborHTMLParser(contenido)
+        encabezados = [ th.text(separator=' ') for th in arbol.css('thead th') ]
+        filas = [ [ td.text() for td in tr.iter() if td.tag == 'td' ] for tr in arbol.css('tr') ]
+        return encabezados, filas
+
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(contenido, motor, parse_only=SoupStrainer(['thead', 'tr']))
+    encabezado = soup.find('thead')
+    encabezados = [ th.get_text(' ') for th in encabezado.find_all('th') ] if encabezado else []
+    filas = [ [ td.get_text() for td in tr.find_all('td', recursive=False) ] for tr in soup.find_all('tr') ]
+    return encabezados, filas
+
+
+etiquetas_dpa = ('DPA - Emisión primaria de acciones ordinarias', 'DPS - Common Stock Primary Issue')
+
+
+# recorre la tabla del estado una vez: encabezado -> periodos, cada fila con un valor por periodo -> partida
+def leer_tabla_estado(contenido, motor=None):
+    encabezados, celdas = filas_html(contenido, motor)
+    periodos = [ fecha_periodo(texto) for texto in encabezados[1:] ]
+
+    etiquetas = []
+    filas = []
+    for tds in celdas:
+        if len(tds) < 2 or (periodos and len(tds) != len(periodos) + 1):
+            continue
+        etiquetas.append(tds[0].strip())
+        filas.append([ convertir_texto(td) for td in tds[1:] ])
+
+    if not periodos and filas:
+        periodos = [ None ] * len(filas[0])
+
+    return TablaEstado(periodos, etiquetas, np.array(filas, dtype=np.float64).reshape(len(filas), len(periodos)))
 
 
 # c = un tercer array donde aplicar la funcion d
+# un periodo al que le falta alguno de los datos (NaN en el historico o en las series TTM) queda en NaN sin pasar
+# por d, que lo tomaria como un valor no positivo y retornaria 0
 def array_calculations(a, b, d, c=None):
     a = a()
     b = b()
-    if c is not None: c = c()
-    return [ round(d(x, b[i], c[i]), 2) if c is not None else round(d(x, b[i]), 2) for i, x in enumerate(a)]
+    c = c() if c is not None else None
+    resultado = []
+    for i, x in enumerate(a):
+        argumentos = (x, b[i]) if c is None else (x, b[i], c[i])
+        resultado.append(np.nan if np.isnan(argumentos).any() else round(d(*argumentos), 2))
+    return resultado
+
+
+# promedio sin los periodos que faltan (NaN en el historico o en las series TTM); NaN si no queda ninguno
+def promedio(valores):
+    valores = np.asarray(valores, dtype=np.float64)
+    valores = valores[~np.isnan(valores)]
+    return np.mean(valores) if len(valores) else np.nan
+
+
+# True o False segun `cumple(valor)`, o None (sin datos) si el valor es NaN
+def veredicto(valor, cumple):
+    return None if valor is None or np.isnan(valor) else bool(cumple(valor))
+
+
+# años de las fechas de cierre de los periodos con fraccion por mes (un trimestre = 0.25), NaN si la fecha no se pudo leer
+def anios_periodos(periodos):
+    return np.array([ p.year + (p.month - 1) / 12 if p is not None else np.nan for p in periodos ], dtype=np.float64)
+
+
+"""
+  Pendiente de la recta de minimos cuadrados (crecimiento por año) de cada fila de `series`, en forma cerrada:
+  sum((x - x_medio) * y) / sum((x - x_medio)^2), todas las filas en una sola operacion.
+  anios: un vector comun a todas las filas o una matriz con uno por fila. Los NaN (periodos que faltan) no
+  se consideran; una fila con menos de dos periodos tiene pendiente NaN.
+"""
+def razones_crecimiento(series, anios):
+    y = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    x = np.broadcast_to(np.asarray(anios, dtype=np.float64), y.shape)
+    validos = ~(np.isnan(x) | np.isnan(y))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = validos.sum(axis=1)
+        x_medio = np.where(validos, x, 0).sum(axis=1) / n
+        dx = np.where(validos, x - x_medio[:, None], 0)
+        # como sum(dx) = 0, sum(dx * (y - y_medio)) = sum(dx * y)
+        pendiente = (dx * np.where(validos, y, 0)).sum(axis=1) / (dx * dx).sum(axis=1)
+    return np.round(pendiente, 2)
+
+
+# una sola serie; sin años se asumen periodos anuales consecutivos, el mas reciente primero
+def razon_crecimiento(arreglo, anios=None):
+    if anios is None:
+        anios = -np.arange(len(arreglo), dtype=np.float64)
+    largo = min(len(arreglo), len(anios))
+    return float(razones_crecimiento(np.asarray(arreglo, dtype=np.float64)[:largo], np.asarray(anios)[:largo])[0])
+
+
+def url_estado(stock_id, report_type, period_type):
+    return base_url + stock_id + '&report_type=' + report_type + '&period_type=' + period_type
+
+
+def eps_data(stock_name):
+    return {"ajusteipc": 0, "fecajuste": "", "fecbal": "2024-04-10", "nemo": stock_name, "tipobal": "I"}
+
+
+"""
+  Mediciones por empresa y por fase (ver --profile): fetch (y dentro de el, connect = dns + tcp + tls y transfer),
+  parse, extract (partidas leidas de las tablas) y compute (campos y criterios calculados), con los bytes de
+  cada documento. Desactivado, medir() retorna un contexto vacio y no se registra nada.
+  Las fases se pueden anidar (ej: un compute que lee partidas, o un extract que parsea la tabla la primera vez que
+  se lee): en el resumen cada medicion cuenta solo su tiempo propio, sin el de las mediciones anidadas en el mismo
+  hilo o corrutina, y los bytes se cuentan una vez, en fetch. La traza mantiene la duracion completa y los bytes
+  de cada evento.
+"""
+class Perfil:
+    fases = ('fetch', 'connect', 'transfer', 'parse', 'extract', 'compute')
+
+    def __init__(self):
+        self.activo = False
+        self.eventos = []
+        self.origen = time.perf_counter()
+
+
+    def activar(self):
+        self.activo = True
+        self.eventos = []
+        self.origen = time.perf_counter()
+
+
+    # inicio y fin de time.perf_counter(); propio: segundos sin las mediciones anidadas (por defecto fin - inicio)
+    def registrar(self, ticker, fase, nombre, inicio, fin, bytes=0, propio=None):
+        propio = fin - inicio if propio is None else propio
+        self.eventos.append((ticker, fase, nombre, inicio, fin, bytes, propio, threading.get_ident()))
+
+
+    def medir(self, ticker, fase, nombre, bytes=0):
+        if not self.activo:
+            return sin_medicion
+        return Medicion(self, ticker, fase, nombre, bytes)
+
+
+    # ticker -> fase -> ms propios, mas los bytes descargados (parse registra los mismos bytes que su fetch)
+    def resumen(self):
+        resumen = {}
+        for ticker, fase, _, _, _, bytes, propio, _ in self.eventos:
+            fila = resumen.setdefault(ticker, dict({ f: 0.0 for f in self.fases }, bytes=0))
+            fila[fase] += 1000 * propio
+            if fase == 'fetch':
+                fila['bytes'] += bytes
+        return resumen
+
+
+    def imprimir_resumen(self):
+        print('')
+        print('ticker'.ljust(18) + ''.join((f + ' ms').rjust(13) for f in self.fases) + 'bytes'.rjust(12))
+        for ticker, fila in sorted(self.resumen().items()):
+            print(ticker.ljust(14) + ''.join(('%.1f' % fila[f]).rjust(13) for f in self.fases) + str(fila['bytes']).rjust(12))
+
+
+    # formato Trace Event (chrome://tracing, Perfetto): una fila (tid) por empresa, tiempos en microsegundos
+    def traza(self):
+        filas = {}
+        eventos = []
+        for ticker, fase, nombre, inicio, fin, bytes, _, _ in self.eventos:
+            tid = filas.setdefault(ticker, len(filas) + 1)
+            eventos.append({ 'name': fase + ' ' + nombre, 'cat': fase, 'ph': 'X', 'pid': 1, 'tid': tid,
+                'ts': round(1e6 * (inicio - self.origen), 1), 'dur': round(1e6 * (fin - inicio), 1), 'args': { 'bytes': bytes } })
+        nombres = [ { 'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': { 'name': ticker } } for ticker, tid in filas.items() ]
+        return { 'traceEvents': nombres + eventos, 'displayTimeUnit': 'ms' }
+
+
+    def guardar_traza(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(self.traza(), archivo)
+
+
+class Medicion:
+
+    def __init__(self, perfil, ticker, fase, nombre, bytes):
+        self.perfil = perfil
+        self.ticker = ticker
+        self.fase = fase
+        self.nombre = nombre
+        self.bytes = bytes
+
+    def __enter__(self):
+        self.anidado = 0.0
+        self.externa = medicion_abierta.get()
+        self.token = medicion_abierta.set(self)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        fin = time.perf_counter()
+        medicion_abierta.reset(self.token)
+        if self.externa is not None:
+            self.externa.anidado += fin - self.inicio
+        self.perfil.registrar(self.ticker, self.fase, self.nombre, self.inicio, fin, self.bytes, fin - self.inicio - self.anidado)
+
+
+sin_medicion = contextlib.nullcontext()
+# la Medicion mas interna abierta en este hilo o tarea de asyncio (cada tarea tiene su copia del contexto)
+medicion_abierta = contextvars.ContextVar('medicion_abierta', default=None)
+perfil = Perfil()
+
+
+"""
+  Eventos de httpcore de un pedido (extension 'trace' de httpx): connect va desde que se abre el socket tcp
+  (incluye la resolucion dns) hasta terminar el handshake tls, transfer desde que se envian los encabezados
+  hasta recibir el cuerpo. Con una conexion reutilizada del pool no hay connect.
+"""
+class TrazaHttp:
+
+    def __init__(self):
+        self.tiempos = {}
+
+    async def evento(self, nombre, info):
+        self.tiempos[nombre.replace('http11.', '').replace('http2.', '')] = time.perf_counter()
+
+    def tramos(self):
+        t = self.tiempos
+        tramos = {}
+        if 'connection.connect_tcp.started' in t:
+            fin = t.get('connection.start_tls.complete', t.get('connection.connect_tcp.complete'))
+            tramos['connect'] = (t['connection.connect_tcp.started'], fin)
+        if 'send_request_headers.started' in t and 'receive_response_body.complete' in t:
+            tramos['transfer'] = (t['send_request_headers.started'], t['receive_response_body.complete'])
+        return tramos
+
+
+# pedido: extensions de httpx -> corrutina de la respuesta; solo con el perfil activo se agrega la traza
+async def pedir_medido(ticker, documento, pedido):
+    if not perfil.activo:
+        return await pedido({})
+
+    traza = TrazaHttp()
+    inicio = time.perf_counter()
+    respuesta = await pedido({ 'trace': traza.evento })
+    perfil.registrar(ticker, 'fetch', documento, inicio, time.perf_counter(), len(respuesta.content))
+    for fase, (desde, hasta) in traza.tramos().items():
+        if hasta is not None:
+            perfil.registrar(ticker, fase, documento, desde, hasta)
+    return respuesta
+
+
+"""
+  Errores tipados de la descarga y lectura de documentos: el screener los registra y pasa a la siguiente empresa
+  en vez de seguir calculando con valores None.
+"""
+class ErrorDescarga(Exception):
+    def __init__(self, ticker, documento, mensaje):
+        super().__init__(ticker + ' ' + documento + ': ' + mensaje)
+        self.ticker = ticker
+        self.documento = documento
+
+
+# respuesta con codigo de error, o sin respuesta (codigo None) despues de agotar los reintentos
+class ErrorHttp(ErrorDescarga):
+    def __init__(self, ticker, documento, codigo, mensaje=None):
+        super().__init__(ticker, documento, mensaje or 'http ' + str(codigo))
+        self.codigo = codigo
+
+
+# la empresa no termino de descargarse dentro de su plazo
+class PlazoAgotado(ErrorDescarga):
+    pass
+
+
+# el sitio fallo demasiadas veces seguidas, no se le pide nada hasta que pase el enfriamiento
+class CircuitoAbierto(ErrorDescarga):
+    pass
+
+
+# el documento se descargo pero no se pudo leer
+class ErrorDocumento(Exception):
+    def __init__(self, ticker, documento, mensaje):
+        super().__init__(ticker + ' ' + documento + ': ' + mensaje)
+        self.ticker = ticker
+        self.documento = documento
+
+
+"""
+  Circuito por sitio: despues de `umbral` fallos seguidos (sin respuesta o 5xx) se abre y todos los pedidos a ese
+  sitio fallan de inmediato durante `enfriamiento` segundos; luego se deja pasar el siguiente pedido, si vuelve a
+  fallar se abre otra vez y si responde se cierra.
+"""
+class Circuito:
+
+    def __init__(self, umbral, enfriamiento):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+
+
+    def permitir(self, ticker, documento, host):
+        restante = self.abierto_hasta - time.monotonic()
+        if restante > 0:
+            raise CircuitoAbierto(ticker, documento, host + ' no responde, se reintenta en ' + str(round(restante)) + ' s')
+
+
+    def exito(self):
+        self.fallos = 0
+
+
+    def fallo(self):
+        self.fallos += 1
+        if self.fallos >= self.umbral:
+            self.abierto_hasta = time.monotonic() + self.enfriamiento
+            # al volver, un solo fallo mas lo abre de nuevo
+            self.fallos = self.umbral - 1
+
+
+"""
+  Limite de pedidos por segundo a un sitio (token bucket): hasta `rafaga` pedidos seguidos, luego uno cada 1/tasa s.
+  La tasa se adapta con las respuestas (AIMD): cada respuesta exitosa la sube en incremento / tasa (cerca de
+  `incremento` pedidos/s por segundo) hasta `tasa_maxima`, un 429 la divide por 2 y detiene los pedidos durante
+  el Retry-After. Un 503 o un 5xx con Retry-After (el sitio avisa que esta sobrecargado) la baja un 20 %; otros 5xx
+  solo si llegan `umbral_5xx` seguidos sin una respuesta exitosa entre medio, un 500 aislado no tiene que ver con la
+  carga y solo se reintenta. Solo baja una vez por los pedidos enviados antes de la ultima baja, asi una rafaga de
+  429 no la lleva al minimo. Un screener largo se mantiene cerca del maximo que el sitio tolera.
+  Mide los pedidos por segundo logrados y el tiempo que cada pedido espero su turno.
+"""
+class Limitador:
+
+    def __init__(self, tasa=10.0, rafaga=10, tasa_minima=0.2, tasa_maxima=100.0, incremento=2.0, umbral_5xx=3):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.tasa_minima = tasa_minima
+        self.tasa_maxima = tasa_maxima
+        self.incremento = incremento
+        self.umbral_5xx = umbral_5xx
+        self.errores_seguidos = 0
+        self.tokens = float(rafaga)
+        self.actualizado = time.monotonic()
+        self.detenido_hasta = 0.0
+        self.ultima_baja = 0.0
+        self.candado = threading.Lock()
+
+        self.pedidos = 0
+        self.limitados = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.primero = None
+        self.ultimo = None
+
+
+    # espera hasta que haya un token, con la tasa vigente en cada revision; retorna el momento de envio
+    async def esperar(self):
+        llegada = time.monotonic()
+        while True:
+            with self.candado:
+                ahora = time.monotonic()
+                self.tokens = min(self.rafaga, self.tokens + (ahora - self.actualizado) * self.tasa)
+                self.actualizado = ahora
+                if ahora >= self.detenido_hasta and self.tokens >= 1:
+                    self.tokens -= 1
+                    espera = ahora - llegada
+                    self.pedidos += 1
+                    self.espera_total += espera
+                    self.espera_maxima = max(self.espera_maxima, espera)
+                    self.primero = self.primero or ahora
+                    self.ultimo = ahora
+                    return ahora
+                falta = max(self.detenido_hasta - ahora, (1 - self.tokens) / self.tasa)
+            await asyncio.sleep(falta)
+
+
+    def exito(self):
+        with self.candado:
+            self.errores_seguidos = 0
+            self.tasa = min(self.tasa_maxima, self.tasa + self.incremento / self.tasa)
+
+
+    # enviado: momento de envio del pedido (de esperar)
+    def bajar(self, enviado, factor):
+        if enviado >= self.ultima_baja:
+            self.tasa = max(self.tasa_minima, self.tasa * factor)
+            self.ultima_baja = time.monotonic()
+
+
+    def limitado(self, enviado, retry_after=None):
+        with self.candado:
+            self.limitados += 1
+            self.bajar(enviado, 0.5)
+            pausa = retry_after if retry_after is not None else 1 / self.tasa
+            self.detenido_hasta = max(self.detenido_hasta, time.monotonic() + pausa)
+            self.tokens = min(self.tokens, 0.0)
+
+
+    # respuesta 5xx; sobrecarga: 503 o con Retry-After
+    def error_servidor(self, enviado, sobrecarga=False):
+        with self.candado:
+            self.errores_seguidos += 1
+            if sobrecarga or self.errores_seguidos >= self.umbral_5xx:
+                self.bajar(enviado, 0.8)
+                self.errores_seguidos = 0
+
+
+    def metricas(self):
+        duracion = (self.ultimo - self.primero) if self.pedidos > 1 else 0.0
+        return {
+            'pedidos': self.pedidos,
+            'pedidos_por_segundo': round(self.pedidos / duracion, 2) if duracion > 0 else None,
+            'espera_media_ms': round(1000 * self.espera_total / self.pedidos, 1) if self.pedidos else 0.0,
+            'espera_maxima_ms': round(1000 * self.espera_maxima, 1),
+            'tasa': round(self.tasa, 2),
+            'limitados': self.limitados,
+        }
+
+
+"""
+  Reintentos de cada pedido (sin respuesta, 429 o 5xx) con espera exponencial y jitter completo: un valor al azar
+  entre 0 y min(espera_maxima, espera_base * 2^intento), o el Retry-After del servidor si es mayor.
+  plazo: segundos maximos para descargar todos los documentos de una empresa. Un circuito y un limitador por sitio.
+  El timeout de cada pedido es el del cliente http (ClienteHttp.timeout, --timeout).
+"""
+class PoliticaDescarga:
+
+    def __init__(self, reintentos=3, espera_base=0.5, espera_maxima=8.0, plazo=60.0, umbral_circuito=5, enfriamiento=30.0,
+            tasa=10.0, tasa_maxima=100.0):
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.plazo = plazo
+        self.umbral_circuito = umbral_circuito
+        self.enfriamiento = enfriamiento
+        self.tasa = tasa
+        self.tasa_maxima = tasa_maxima
+        self.circuitos = {}
+        self.limitadores = {}
+
+
+    def circuito(self, host):
+        if host not in self.circuitos:
+            self.circuitos[host] = Circuito(self.umbral_circuito, self.enfriamiento)
+        return self.circuitos[host]
+
+
+    def limitador(self, host):
+        if host not in self.limitadores:
+            self.limitadores[host] = Limitador(self.tasa, tasa_maxima=self.tasa_maxima)
+        return self.limitadores[host]
+
+
+    # host -> metricas de su limitador, solo los sitios a los que se pidio algo
+    def metricas(self):
+        return { host: limitador.metricas() for host, limitador in self.limitadores.items() if limitador.pedidos }
+
+
+    def espera(self, intento, retry_after=None):
+        espera = random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** intento))
+        return max(espera, retry_after or 0)
+
+
+politica_descarga = PoliticaDescarga()
+
+
+# segundos de un encabezado Retry-After numerico (la forma con fecha http se ignora)
+def segundos_retry_after(respuesta):
+    try:
+        return float(respuesta.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+# pedido con reintentos y circuito por sitio; retorna la respuesta exitosa o lanza ErrorDescarga
+async def pedir_con_reintentos(ticker, documento, url, pedido, politica=None):
+    import httpx
+    politica = politica or politica_descarga
+    host = urllib.parse.urlsplit(url).hostname or url
+    circuito = politica.circuito(host)
+    limitador = politica.limitador(host)
+
+    for intento in range(politica.reintentos + 1):
+        circuito.permitir(ticker, documento, host)
+        enviado = await limitador.esperar()
+        retry_after = None
+        try:
+            respuesta = await pedir_medido(ticker, documento, pedido)
+        except httpx.TransportError as e:
+            error = ErrorHttp(ticker, documento, None, 'sin respuesta de ' + host + ' (' + type(e).__name__ + ')')
+            circuito.fallo()
+        else:
+            if respuesta.status_code < 400:
+                circuito.exito()
+                limitador.exito()
+                return respuesta
+            error = ErrorHttp(ticker, documento, respuesta.status_code)
+            if respuesta.status_code == 429:
+                # el sitio responde, solo pide ir mas lento
+                retry_after = segundos_retry_after(respuesta)
+                limitador.limitado(enviado, retry_after)
+            elif respuesta.status_code >= 500:
+                circuito.fallo()
+                retry_after = segundos_retry_after(respuesta)
+                limitador.error_servidor(enviado, respuesta.status_code == 503 or retry_after is not None)
+            else:
+                # 4xx: reintentar no cambia la respuesta
+                circuito.exito()
+                raise error
+
+        if intento < politica.reintentos:
+            await asyncio.sleep(politica.espera(intento, retry_after))
+    raise error
+
+
+"""
+  Cache en disco de las respuestas HTTP, un archivo por documento.
+  Cada tipo de documento tiene su propio TTL (en segundos): los estados financieros cambian pocas veces al año,
+  el precio en cambio debe estar fresco. En modo offline se sirve solo desde la cache, sin importar la antiguedad.
+  Las escrituras van a un archivo temporal que luego se renombra (os.replace es atomico), asi varios procesos
+  del screener pueden compartir el mismo directorio.
+"""
+class CacheHttp:
+    ttl_por_defecto = {
+        'BAL':    7 * 24 * 3600,
+        'INC':    7 * 24 * 3600,
+        'CAS':    7 * 24 * 3600,
+        'ratios': 24 * 3600,
+        'precio': 60,
+        'eps':    24 * 3600,
+    }
+
+    def __init__(self, directorio, ttl=None, offline=False):
+        self.directorio = directorio
+        self.ttl = dict(self.ttl_por_defecto, **(ttl or {}))
+        self.offline = offline
+
+
+    def ruta(self, tipo, clave):
+        return os.path.join(self.directorio, re.sub(r'[^\w.-]', '_', tipo + '_' + clave))
+
+
+    def leer(self, tipo, clave):
+        try:
+            ruta = self.ruta(tipo, clave)
+            if self.offline or time.time() - os.path.getmtime(ruta) < self.ttl[tipo]:
+                with open(ruta, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+        return None
+
+
+    def guardar(self, tipo, clave, contenido):
+        os.makedirs(self.directorio, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(contenido)
+            os.replace(temporal, self.ruta(tipo, clave))
+        except OSError:
+            os.unlink(temporal)
+            raise
+
+
+    # pedido: funcion que retorna la corrutina de la descarga, solo se llama si no hay copia vigente
+    async def obtener(self, tipo, clave, pedido):
+        contenido = self.leer(tipo, clave)
+        if contenido is not None:
+            return contenido
+
+        if self.offline:
+            raise LookupError(tipo + ' ' + clave + ' no esta en la cache (modo offline)')
+
+        respuesta = await pedido()
+        # las respuestas con error no se guardan, para no servirlas durante todo el TTL
+        if respuesta.is_success:
+            self.guardar(tipo, clave, respuesta.content)
+        return respuesta.content
+
+
+directorio_cache = os.environ.get('BRATTIA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'brattia'))
+cache_http = CacheHttp(directorio_cache)
+
+
+"""
+  Tablas parseadas como datos simples (listas, fechas y arrays de numpy) para guardarlas en CacheParseo o pasarlas
+  entre procesos. El pickle de una instancia guarda el modulo que definio su clase, que puede ser __main__ (stocks.py),
+  __mp_main__ (los procesos de parseo) o stocks (import stocks), y desde otro modulo no se puede leer.
+"""
+def como_datos(valor):
+    if isinstance(valor, TablaEstado):
+        return ('TablaEstado', list(valor.periodos), list(valor.etiquetas), np.asarray(valor.valores, dtype=np.float64))
+    if isinstance(valor, TablaRatios):
+        return ('TablaRatios', list(valor.etiquetas), list(valor.empresa), list(valor.industria))
+    return ('valor', valor)
+
+
+def desde_datos(datos):
+    if datos[0] == 'TablaEstado':
+        return TablaEstado(*datos[1:])
+    if datos[0] == 'TablaRatios':
+        return TablaRatios(*datos[1:])
+    return datos[1]
+
+
+"""
+  Ultima version parseada de cada documento, junto al hash (sha256) de su contenido. Casi siempre los estados
+  descargados son identicos a los de la corrida anterior: si el hash coincide se reutiliza la tabla ya parseada
+  en vez de volver a recorrer el html. Cuenta los documentos reutilizados y parseados para el resumen.
+  Cada archivo guarda (formato, hash, como_datos(tabla)); uno que no se puede leer, sea por el motivo que sea
+  (archivo truncado, formato anterior, pickle de otra version), cuenta como no guardado y se vuelve a parsear.
+"""
+class CacheParseo:
+    formato = 2
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.reutilizados = collections.Counter()
+        self.parseados = collections.Counter()
+
+
+    def ruta(self, tipo, clave):
+        return os.path.join(self.directorio, re.sub(r'[^\w.-]', '_', tipo + '_' + clave) + '.pickle')
+
+
+    # tabla guardada para un contenido con esta huella, o None si no hay
+    def leer(self, tipo, clave, huella):
+        if self.directorio is None:
+            return None
+        try:
+            with open(self.ruta(tipo, clave), 'rb') as f:
+                formato, guardada, datos = pickle.load(f)
+            if formato == self.formato and guardada == huella:
+                return desde_datos(datos)
+        except Exception:
+            pass
+        return None
+
+
+    def guardar(self, tipo, clave, huella, valor):
+        if self.directorio is None:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            fd, temporal = tempfile.mkstemp(dir=self.directorio, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self.formato, huella, como_datos(valor)), f)
+            os.replace(temporal, self.ruta(tipo, clave))
+        except OSError:
+            pass
+
+
+    # lector: funcion que parsea el contenido (ej: leer_tabla_estado); retorna (valor, True si se reutilizo)
+    # sin directorio no se guarda nada y siempre se parsea
+    def parsear(self, tipo, clave, contenido, lector):
+        if self.directorio is None:
+            self.parseados[tipo] += 1
+            return lector(contenido), False
+
+        huella = hashlib.sha256(contenido).hexdigest()
+        valor = self.leer(tipo, clave, huella)
+        if valor is not None:
+            self.reutilizados[tipo] += 1
+            return valor, True
+
+        valor = lector(contenido)
+        self.parseados[tipo] += 1
+        self.guardar(tipo, clave, huella, valor)
+        return valor, False
+
+
+    def resumen(self):
+        return str(sum(self.reutilizados.values())) + ' reutilizados, ' + str(sum(self.parseados.values())) + ' parseados'
+
+
+cache_parseo = CacheParseo(os.path.join(cache_http.directorio, 'parseados'))
+
+
+"""
+  Historia de los estados financieros en SQLite, una fila por (ticker, estado, tipo de periodo, partida, periodo).
+  investing.com entrega solo los ultimos 4 periodos; cada descarga se agrega aqui (solo los periodos nuevos o
+  con valores distintos), asi la historia crece con el tiempo y se puede leer completa sin usar la red.
+  Cada operacion abre su propia conexion, por lo que se puede usar desde varios hilos o procesos a la vez.
+"""
+class AlmacenEstados:
 
+    def __init__(self, ruta):
+        self.usar(ruta)
 
-def razon_crecimiento(arreglo):
-    x = np.array([2022, 2021, 2020, 2019])
-    y = np.array(arreglo)
-    return round(np.linalg.lstsq(np.vstack([x, np.ones(len(x))]).T, y, rcond=None)[0][0], 2)
 
+    # cambia la base (ej: usar_base_url); la tabla se crea en la primera conexion
+    def usar(self, ruta):
+        self.ruta = ruta
+        self.creado = False
 
+
+    def conectar(self):
+        if not self.creado:
+            os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        if not self.creado:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute("""CREATE TABLE IF NOT EXISTS partidas (
+                ticker TEXT, estado TEXT, period_type TEXT, etiqueta TEXT, periodo TEXT,
+                valor REAL, orden INTEGER, actualizado REAL,
+                PRIMARY KEY (ticker, estado, period_type, etiqueta, periodo)) WITHOUT ROWID""")
+            self.creado = True
+        return conexion
+
+
+    # agrega los periodos de `tabla` (TablaEstado); retorna cuantos valores eran nuevos o cambiaron
+    def guardar(self, ticker, estado, period_type, tabla):
+        ahora = time.time()
+        filas = [ (ticker, estado, period_type, etiqueta, periodo.isoformat(), float(tabla.valores[i, j]), i, ahora)
+            for i, etiqueta in enumerate(tabla.etiquetas)
+            for j, periodo in enumerate(tabla.periodos) if periodo is not None ]
+
+        conexion = self.conectar()
+        try:
+            with conexion:
+                antes = conexion.total_changes
+                conexion.executemany("""INSERT INTO partidas VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (ticker, estado, period_type, etiqueta, periodo) DO UPDATE
+                    SET valor = excluded.valor, orden = excluded.orden, actualizado = excluded.actualizado
+                    WHERE valor IS NOT excluded.valor""", filas)
+                return conexion.total_changes - antes
+        finally:
+            conexion.close()
+
+
+    # TablaEstado con todos los periodos guardados (el mas reciente primero); NaN donde una partida no tiene el periodo
+    def cargar(self, ticker, estado, period_type):
+        conexion = self.conectar()
+        try:
+            filas = conexion.execute("""SELECT etiqueta, periodo, valor, orden FROM partidas
+                WHERE ticker = ? AND estado = ? AND period_type = ?""", (ticker, estado, period_type)).fetchall()
+        finally:
+            conexion.close()
+
+        if not filas:
+            raise LookupError(estado + ' ' + ticker + ' ' + period_type + ' no tiene historia guardada')
+
+        periodos = sorted({ f[1] for f in filas }, reverse=True)
+        orden = {}
+        for etiqueta, _, _, o in filas:
+            orden[etiqueta] = min(o, orden.get(etiqueta, o))
+        etiquetas = sorted(orden, key=lambda e: (orden[e], e))
+
+        fila_de = { e: i for i, e in enumerate(etiquetas) }
+        columna_de = { p: j for j, p in enumerate(periodos) }
+        valores = np.full((len(etiquetas), len(periodos)), np.nan)
+        for etiqueta, periodo, valor, _ in filas:
+            valores[fila_de[etiqueta], columna_de[periodo]] = valor
+
+        return TablaEstado([ date.fromisoformat(p) for p in periodos ], etiquetas, valores)
+
+
+ruta_base_datos = os.environ.get('BRATTIA_DB', os.path.join(os.path.expanduser('~'), '.local', 'share', 'brattia', 'estados.sqlite'))
+almacen_estados = AlmacenEstados(ruta_base_datos)
+usar_base_url(os.environ.get('BRATTIA_BASE_URL'))
+
+
+"""
+  Cliente HTTP compartido por todo el proceso: un httpx.AsyncClient con pool de conexiones y keep-alive
+  (HTTP/2 si esta instalado h2), asi varias empresas reutilizan las conexiones ya abiertas con investing.com
+  y bolsadesantiago.com en vez de repetir el handshake TLS en cada descarga.
+  Las conexiones de un AsyncClient quedan ligadas a su event loop, por eso el cliente vive en un loop propio
+  (en un hilo aparte) y las descargas se ejecutan ahi con ejecutar(), aunque se llame varias veces.
+"""
+class ClienteHttp:
+
+    def __init__(self, max_conexiones=20, max_keepalive=10, keepalive=30.0, timeout=10.0, http2=None):
+        self.max_conexiones = max_conexiones
+        self.max_keepalive = max_keepalive
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.http2 = importlib.util.find_spec('h2') is not None if http2 is None else http2
+        self.cliente = None
+        self.loop = None
+        self.candado = threading.Lock()
+
+
+    def crear(self):
+        import httpx
+        limites = httpx.Limits(max_connections=self.max_conexiones, max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive)
+        return httpx.AsyncClient(limits=limites, timeout=self.timeout, http2=self.http2)
+
+
+    def iniciar(self):
+        with self.candado:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='cliente-http', daemon=True).start()
+                self.cliente = self.crear()
+                atexit.register(self.cerrar)
+
+
+    # funcion: recibe el AsyncClient y retorna la corrutina a ejecutar, ej: lambda c: descargar_documentos(..., c)
+    def ejecutar(self, funcion):
+        self.iniciar()
+        try:
+            en_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            raise RuntimeError('ClienteHttp.ejecutar no se puede llamar desde una corrutina del mismo cliente')
+        return asyncio.run_coroutine_threadsafe(funcion(self.cliente), self.loop).result()
+
+
+    # como ejecutar, con una funcion que retorna un generador asincrono: entrega cada valor apenas esta listo
+    def iterar(self, funcion):
+        self.iniciar()
+        generador = funcion(self.cliente)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(generador.__anext__(), self.loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(generador.aclose(), self.loop).result()
+
+
+    def cerrar(self):
+        with self.candado:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.cliente.aclose(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.cliente = None
+            self.loop = None
+
+
+cliente_http = ClienteHttp()
+
+
+# descarga en paralelo todos los documentos de una empresa (balance, resultados, flujos, ratios, precio y EPS)
+# claves: solo esos documentos (ej: ['precio', 'eps']), por defecto todos
+# si un documento falla se cancelan los demas y se lanza el ErrorDescarga, sin esperar al resto
+# limite: momento (time.monotonic) en que vence el plazo de la empresa, para compartirlo entre varias llamadas;
+# por defecto el plazo de la politica desde ahora
+async def descargar_documentos(stock_name, period_type, client=None, cache=None, claves=None, politica=None, limite=None):
+    if client is None:
+        import httpx
+        async with httpx.AsyncClient() as client:
+            return await descargar_documentos(stock_name, period_type, client, cache, claves, politica, limite)
+
+    cache = cache or cache_http
+    slug = get_slug(stock_name)
+    stock_id = get_id(stock_name)
+
+    def get(documento, url):
+        return lambda: pedir_con_reintentos(stock_name, documento, url, lambda ext: client.get(url, extensions=ext), politica)
+
+    pedidos = {
+        'BAL':    cache.obtener('BAL', stock_id + '_' + period_type, get('BAL', url_estado(stock_id, 'BAL', period_type))),
+        'INC':    cache.obtener('INC', stock_id + '_' + period_type, get('INC', url_estado(stock_id, 'INC', period_type))),
+        'CAS':    cache.obtener('CAS', stock_id + '_' + period_type, get('CAS', url_estado(stock_id, 'CAS', period_type))),
+        'ratios': cache.obtener('ratios', slug, get('ratios', equities_url + slug + '-ratios')),
+        'precio': cache.obtener('precio', slug, get('precio', equities_url + slug)),
+        'eps':    cache.obtener('eps', stock_name, lambda: pedir_con_reintentos(stock_name, 'eps', eps_url, lambda ext:
+            client.post(eps_url, headers=eps_headers, json=eps_data(stock_name), extensions=ext), politica)),
+    }
+    if claves is not None:
+        for clave in set(pedidos) - set(claves):
+            pedidos.pop(clave).close()
+
+    plazo = (politica or politica_descarga).plazo
+    limite = time.monotonic() + plazo if limite is None else limite
+    tareas = { clave: asyncio.ensure_future(pedido) for clave, pedido in pedidos.items() }
+    try:
+        # vuelve al primer error, al terminar todas o al vencer el plazo; las pendientes se leen antes de cancelarlas
+        hechas, pendientes = await asyncio.wait(tareas.values(), timeout=max(0.0, limite - time.monotonic()),
+            return_when=asyncio.FIRST_EXCEPTION)
+        for clave, tarea in tareas.items():
+            if tarea in hechas and tarea.exception() is not None:
+                e = tarea.exception()
+                if isinstance(e, ErrorDescarga):
+                    raise e
+                # ej: LookupError en modo offline
+                raise ErrorDescarga(stock_name, clave, type(e).__name__ + ': ' + str(e)) from e
+        if pendientes:
+            raise PlazoAgotado(stock_name, ', '.join(c for c, t in tareas.items() if t in pendientes),
+                'no termino dentro del plazo de ' + str(plazo) + ' s')
+    finally:
+        for tarea in tareas.values():
+            tarea.cancel()
+
+    return { clave: tarea.result() for clave, tarea in tareas.items() }
+
+
+# documentos de una empresa para varios period_type en una sola pasada: los estados BAL/INC/CAS de cada uno en
+# paralelo y ratios, precio y EPS (iguales para todos) una sola vez; retorna period_type -> documentos
+async def descargar_empresa(stock_name, period_types, client=None, cache=None, politica=None):
+    if client is None:
+        import httpx
+        async with httpx.AsyncClient() as client:
+            return await descargar_empresa(stock_name, period_types, client, cache, politica)
+
+    # un solo plazo para todos los period_type de la empresa
+    limite = time.monotonic() + (politica or politica_descarga).plazo
+    tareas = [ asyncio.ensure_future(descargar_documentos(stock_name, p, client, cache,
+        None if i == 0 else ('BAL', 'INC', 'CAS'), politica, limite)) for i, p in enumerate(period_types) ]
+    try:
+        documentos = await asyncio.gather(*tareas)
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+    return { p: dict(documentos[0], **d) for p, d in zip(period_types, documentos) }
+
+
+"""
+  Pagina de ratios leida una sola vez: etiqueta (con su periodo TTM, 5YA, MRQ, ANN) -> valor de la empresa
+  y valor de la industria.
+"""
+class TablaRatios:
+    def __init__(self, etiquetas, empresa, industria):
+        self.etiquetas = etiquetas
+        self.empresa = empresa
+        self.industria = industria
+        self.indice = {}
+        for i, etiqueta in enumerate(etiquetas):
+            self.indice.setdefault(normalizar_etiqueta(etiqueta), i)
+
+
+    def posicion(self, etiqueta):
+        etiqueta = normalizar_etiqueta(etiqueta)
+        i = self.indice.get(etiqueta)
+        if i is None:
+            # etiqueta con texto adicional en la celda
+            i = next((j for e, j in self.indice.items() if etiqueta in e), None)
+        return i
+
+
+    # valor de la empresa (o de la industria) para la primera etiqueta (o alias) que exista, 0 si no esta en la pagina
+    def valor(self, *etiquetas, industria=False):
+        for etiqueta in etiquetas:
+            i = self.posicion(etiqueta)
+            if i is not None:
+                return self.industria[i] if industria else self.empresa[i]
+        return float(0)
+
+
+    def __contains__(self, etiqueta):
+        return self.posicion(etiqueta) is not None
+
+
+    # todos los ratios de la empresa
+    def como_dict(self):
+        return { e: self.empresa[i] for i, e in enumerate(self.etiquetas) }
+
+
+# recorre una vez las filas de la pagina de ratios: etiqueta, valor empresa y valor industria
+def leer_ratios(contenido, motor=None):
+    etiquetas = []
+    empresa = []
+    industria = []
+    for tds in filas_html(contenido, motor)[1]:
+        if len(tds) < 2 or not tds[0].strip():
+            continue
+        etiquetas.append(tds[0].strip())
+        empresa.append(convertir_texto(tds[1]))
+        industria.append(convertir_texto(tds[2]) if len(tds) > 2 else float(0))
+
+    return TablaRatios(etiquetas, empresa, industria)
+
+
+# ultimo precio de cierre tal como aparece en la pagina de la accion, con punto decimal
+def leer_precio(contenido, motor=None):
+    elements = textos_html(contenido, 'span', motor)
+    index = 0
+    for i, a in enumerate(elements):
+        # print(str(i) + ':' + a)
+        if a == 'Último cierre':
+            index = i + 1
+            break
+
+    return elements[index].replace('.', '').replace(',', '.')
+
+
+# EPS presente desde la respuesta json de bolsadesantiago
+def leer_eps(contenido, motor=None):
+    return float(json.loads(contenido)["listaResult"][1]['VALOR01'])
+
+
+# documento -> funcion que lo parsea
+lectores = {
+    'BAL':    leer_tabla_estado,
+    'INC':    leer_tabla_estado,
+    'CAS':    leer_tabla_estado,
+    'ratios': leer_ratios,
+    'precio': leer_precio,
+    'eps':    leer_eps,
+}
+
+
+# clave de un documento en CacheParseo: los estados cambian con el period_type, el resto es uno por empresa
+def clave_parseo(stock_name, period_type, tipo):
+    return stock_name + '_' + period_type if tipo in ('BAL', 'INC', 'CAS') else stock_name
+
+
+# razon NaN (menos de dos periodos con datos): sin veredicto
 def check_razon_creciente(razon):
-    print_bool_result(razon > 0)
-    return razon > 0
+    resultado = veredicto(razon, lambda r: r > 0)
+    print_bool_result(resultado)
+    return resultado
 
 
 def check_razon_decreciente(razon):
-    print_bool_result(razon <= 0)
-    return razon <= 0
+    resultado = veredicto(razon, lambda r: r <= 0)
+    print_bool_result(resultado)
+    return resultado
 
 
+"""
+  Memoriza por instancia el resultado de un metodo de Estados. El valor guardado sigue vigente mientras no se
+  vuelva a asignar ninguno de los atributos `fuentes` (ej: self.balances = self.set_balances() lo invalida).
+"""
+def memoizado(*fuentes):
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def envoltura(self, *args):
+            clave = (metodo.__name__,) + args
+            version = tuple(self.versiones[f] for f in fuentes)
+            guardado = self.memo.get(clave)
+            if guardado is not None and guardado[0] == version:
+                self.memo_aciertos[metodo.__name__] += 1
+                return guardado[1]
+
+            self.memo_fallos[metodo.__name__] += 1
+            with perfil.medir(self.stock_name, 'extract', metodo.__name__):
+                valor = metodo(self, *args)
+            # la version de despues: en un Estados recien creado el metodo carga sus fuentes (__getattr__) y cada
+            # carga sube su version; con la de antes la siguiente llamada no acertaria
+            self.memo[clave] = (tuple(self.versiones[f] for f in fuentes), valor)
+            return valor
+        envoltura.fuentes = fuentes
+        return envoltura
+    return decorador
+
+
+"""
+  Los campos de Estados se calculan recien cuando se piden (b.per, b.get_ROE(), ...). Cada campo depende de
+  otros campos o, en las hojas del grafo, de un documento descargado. Al pedir un campo se descargan en paralelo
+  solo los documentos que le faltan y luego se calcula con su set_* correspondiente.
+"""
 class Estados:
-    def __init__(self, stock_name, period_type, n):
+    # atributos de los que dependen los metodos memoizados
+    fuentes_memo = ('balances', 'resultados', 'flujos_caja', 'ratios')
+
+    # campo -> documento del que se lee (hojas del grafo)
+    documento_de = {
+        'balances':      'BAL',
+        'resultados':    'INC',
+        'flujos_caja':   'CAS',
+        'ratios':        'ratios',
+        'precio_actual': 'precio',
+        'eps_presente':  'eps',
+    }
+
+    # campos hoja iguales para todos los period_type
+    campos_comunes = ('ratios', 'precio_actual', 'eps_presente')
+
+    # campo derivado -> campos de los que depende
+    dependencias = {
+        'ROE':                   ('ratios',),
+        'tasa_reparto':          ('ratios',),
+        'g':                     ('ROE', 'tasa_reparto'),
+        'eps_promedio':          ('resultados',),
+        'eps_futuro':            ('eps_presente', 'g'),
+        'precio_accion_futuro':  ('eps_futuro', 'g'),
+        'tasa_dividendos':       ('ratios',),
+        'precio_valor_contable': ('ratios',),
+        'per':                   ('precio_actual', 'eps_presente'),
+    }
+
+    # campo -> como se calcula
+    calculos = {
+        'balances':              lambda b: b.set_balances(),
+        'resultados':            lambda b: b.set_estado_resultado(),
+        'ratios':                lambda b: b.set_ratios(),
+        'precio_actual':         lambda b: b.set_precio_actual(),
+        'eps_presente':          lambda b: b.set_eps_presente(),
+        'flujos_caja':           lambda b: b.set_flujos_caja(),
+        'ROE':                   lambda b: b.set_ROE(),
+        'tasa_reparto':          lambda b: b.set_tasa_reparto(),
+        'g':                     lambda b: b.set_tasa_crecimiento(),
+        'eps_promedio':          lambda b: b.set_eps_promedio(),
+        'eps_futuro':            lambda b: b.set_eps_futuro(b.n),
+        'precio_accion_futuro':  lambda b: b.set_precio_accion_futuro(),
+        'tasa_dividendos':       lambda b: b.dividend_yield(),
+        'precio_valor_contable': lambda b: b.set_precio_valor_contable(),
+        'per':                   lambda b: b.set_per(),
+    }
+
+    # documentos: los ya descargados (de descargar_documentos), el resto se descarga cuando se necesite
+    # cliente: ClienteHttp para esas descargas, por defecto el compartido del proceso
+    # almacen: AlmacenEstados donde se agrega cada estado leido (None para no guardar)
+    # historico: balances, resultados y flujos con todos los periodos del almacen, sin descargarlos
+    # anual: con period_type 'Interim', el Estados 'Annual' de la misma empresa; sus años anteriores al primer
+    # trimestre completan las series (el cierre de un año fiscal es tambien el cierre de un trimestre)
+    # tablas: documentos ya parseados (documento -> valor, ej: los de la etapa de parseo del screener), que no se
+    # descargan ni se parsean de nuevo
+    def __init__(self, stock_name, period_type, n, documentos=None, cliente=None, almacen=almacen_estados, historico=False,
+            anual=None, tablas=None):
+        self.memo = {}
+        self.versiones = collections.Counter()
+        self.memo_aciertos = collections.Counter()
+        self.memo_fallos = collections.Counter()
+
         self.stock_name = stock_name
         self.period_type = period_type
         self.slug = get_slug(stock_name)
         self.stock_id = get_id(stock_name)
-        self.balances = self.set_balances()
-        self.resultados = self.set_estado_resultado()
-        self.ratios = self.set_ratios()
-        self.ROE = self.set_ROE()
-        self.tasa_reparto = self.set_tasa_reparto()
-        self.precio_actual = self.set_precio_actual()
-        self.g = self.set_tasa_crecimiento()
-        self.eps_presente =  self.set_eps_presente()
-        self.eps_promedio =  self.set_eps_promedio()
-        self.eps_futuro = self.set_eps_futuro(n)
-        self.precio_accion_futuro = self.set_precio_accion_futuro()
-        self.tasa_dividendos = self.dividend_yield()
-        self.precio_valor_contable = self.set_precio_valor_contable()
-        self.per = self.set_per()
-        self.flujos_caja = self.set_flujos_caja()
         self.n = n
+        self.documentos = dict(documentos or {})
+        self.cliente = cliente or cliente_http
+        self.almacen = almacen
+        self.historico = historico
+        self.anual = anual
+        self.tablas = dict(tablas or {})
+        self.limite_descarga = None
+
+
+    # solo se llama para atributos que aun no existen: los campos se calculan en el primer acceso
+    def __getattr__(self, nombre):
+        if nombre not in Estados.calculos:
+            raise AttributeError("'Estados' object has no attribute '" + nombre + "'")
+        self.resolver(nombre)
+        return self.__dict__[nombre]
+
+
+    # campos hoja (leidos de un documento) de los que dependen `campos`, recorriendo sus dependencias
+    @classmethod
+    def hojas(cls, campos):
+        hojas = set()
+        for campo in campos:
+            if campo in cls.documento_de:
+                hojas.add(campo)
+            else:
+                hojas |= cls.hojas(cls.dependencias[campo])
+        return hojas
+
+
+    # documentos que necesita un campo
+    @classmethod
+    def documentos_necesarios(cls, campos):
+        return { cls.documento_de[h] for h in cls.hojas(campos) }
+
+
+    # descarga en paralelo los documentos que faltan para `campos` y los calcula; sin campos, todos
+    def resolver(self, *campos):
+        campos = campos or tuple(Estados.calculos)
+        hojas = [ h for h in Estados.hojas(campos) if h not in self.__dict__ ]
+        # con un Estados anual, los campos que no dependen del periodo se leen una sola vez, en el anual
+        comunes = [ h for h in hojas if self.anual is not None and h in Estados.campos_comunes ]
+        if comunes:
+            self.anual.resolver(*comunes)
+            for campo in comunes:
+                setattr(self, campo, getattr(self.anual, campo))
+
+        faltantes = self.documentos_faltantes(campos)
+        if faltantes:
+            self.documentos.update(self.cliente.ejecutar(lambda client:
+                descargar_documentos(self.stock_name, self.period_type, client, claves=faltantes, limite=self.limite())))
+
+        for campo in campos:
+            if campo not in self.__dict__:
+                # los campos hoja se leen de un documento: su tiempo queda en parse
+                with perfil.medir(self.stock_name, 'compute', campo) if campo in Estados.dependencias else sin_medicion:
+                    setattr(self, campo, Estados.calculos[campo](self))
+
+
+    # documentos que aun no se tienen (ni descargados ni parseados) para calcular `campos`
+    def documentos_faltantes(self, campos):
+        hojas = [ h for h in Estados.hojas(campos) if h not in self.__dict__ ]
+        if self.anual is not None:
+            hojas = [ h for h in hojas if h not in Estados.campos_comunes ]
+        faltantes = { Estados.documento_de[h] for h in hojas } - set(self.documentos) - set(self.tablas)
+        if self.historico:
+            faltantes -= { 'BAL', 'INC', 'CAS' }
+        return sorted(faltantes)
+
+
+    # como resolver, pero solo descarga (sin calcular) y con el AsyncClient del llamador: para usar desde una
+    # corrutina, donde resolver no puede esperar al ClienteHttp. Retorna los documentos descargados
+    async def descargar(self, client, *campos):
+        faltantes = self.documentos_faltantes(campos or tuple(Estados.calculos))
+        if faltantes:
+            self.documentos.update(await descargar_documentos(self.stock_name, self.period_type, client, claves=faltantes,
+                limite=self.limite()))
+        return faltantes
+
+
+    # momento en que vence el plazo (--deadline) de las descargas de esta empresa: corre desde la primera y lo
+    # comparten todos los pasos de resolver y descargar (ej: cada filtro de ScreenerFiltrado). Las consultas de
+    # precio de Vigilante no pasan por aqui, cada una tiene su propio plazo
+    def limite(self):
+        if self.limite_descarga is None:
+            self.limite_descarga = time.monotonic() + politica_descarga.plazo
+        return self.limite_descarga
+
+
+    # campos derivados que dependen, directa o indirectamente, de `campo`
+    @classmethod
+    def dependientes(cls, campo):
+        directos = { d for d, fuentes in cls.dependencias.items() if campo in fuentes }
+        return directos.union(*[ cls.dependientes(d) for d in directos ])
+
+
+    # nuevo valor de un campo hoja (ej: el precio de la ultima consulta); sus derivados se borran y se recalculan
+    # al pedirlos, el resto de los campos se mantiene
+    def reemplazar(self, campo, valor):
+        for derivado in Estados.dependientes(campo):
+            self.__dict__.pop(derivado, None)
+        setattr(self, campo, valor)
+
+
+    # al recargar un estado se invalida lo memoizado a partir de el
+    def __setattr__(self, nombre, valor):
+        if nombre in self.fuentes_memo:
+            self.versiones[nombre] += 1
+        object.__setattr__(self, nombre, valor)
+
+
+    # aciertos y fallos de la memoizacion, por metodo
+    def estadisticas_memo(self):
+        metodos = sorted(set(self.memo_aciertos) | set(self.memo_fallos))
+        return { m: { 'aciertos': self.memo_aciertos[m], 'fallos': self.memo_fallos[m] } for m in metodos }
+
+
+    # estado BAL/INC/CAS desde su documento, agregandolo al almacen; en modo historico desde el almacen
+    # los trimestres se leen con todos los guardados: el documento trae pocos y cada ventana TTM necesita 4
+    def leer_estado(self, tipo):
+        if self.historico:
+            return self.almacen.cargar(self.stock_name, tipo, self.period_type)
+
+        tabla, _ = self.parsear(tipo, leer_tabla_estado)
+        # tambien con una tabla reutilizada: el almacen puede ser otro, y si no cambio nada no escribe
+        if self.almacen is not None:
+            self.almacen.guardar(self.stock_name, tipo, self.period_type, tabla)
+            if self.period_type == 'Interim':
+                return self.almacen.cargar(self.stock_name, tipo, self.period_type)
+        return tabla
+
+
+    # estado de flujos (INC/CAS): con trimestres, sumas TTM en los periodos del balance para que todas las series
+    # queden alineadas; con el Estados anual, sus años anteriores completan la serie
+    def leer_flujos(self, tipo, campo):
+        tabla = self.leer_estado(tipo)
+        if self.period_type != 'Interim':
+            return tabla
+        tabla = tabla.ttm()
+        if self.anual is not None:
+            tabla = tabla.extender(getattr(self.anual, campo))
+        return tabla.en_periodos(self.balances.periodos)
+
+
+    # documento `tipo` parseado con `lector`, o la version anterior si el contenido no cambio
+    def parsear(self, tipo, lector):
+        if tipo in self.tablas:
+            # el error de un documento parseado en otro proceso se lanza aqui, al pedir el campo, como si se parseara
+            if isinstance(self.tablas[tipo], Exception):
+                raise self.tablas[tipo]
+            return self.tablas[tipo], True
+
+        clave = clave_parseo(self.stock_name, self.period_type, tipo)
+        contenido = self.documentos[tipo]
+        with perfil.medir(self.stock_name, 'parse', tipo, len(contenido) if contenido else 0):
+            return cache_parseo.parsear(tipo, clave, contenido, lector)
 
 
     # balance de los ultimos 4 años
     def set_balances(self):
-        url= base_url + self.stock_id + '&report_type=BAL&period_type=' + self.period_type
         try:
-            result = httpx.get(url)
-            soup = BeautifulSoup(result.content, 'html.parser')
-            return soup.find_all('td')
-        except:
-            print("una excepcion ocurrio al intentar leer el balance")
+            tabla = self.leer_estado('BAL')
+            if self.period_type == 'Interim' and self.anual is not None:
+                tabla = tabla.extender(self.anual.balances)
+            return tabla
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'BAL', "una excepcion ocurrio al intentar leer el balance") from e
 
 
     # cantidad de dinero que tiene la empresa, para financiar operaciones despues de pagar las deudas de corto plazo
@@ -185,6 +1693,9 @@ class Estados:
     def razon_corriente(self, activo_circulante, pasivo_circulante, inventario=0):
         if pasivo_circulante > 0:
             return (activo_circulante - inventario) / pasivo_circulante
+        elif np.isnan(pasivo_circulante):
+            # la partida no esta en el balance: sin dato, no 0
+            return np.nan
         else:
             print('pasivo circulante debe ser mayor a 0')
             return 0
@@ -194,6 +1705,8 @@ class Estados:
     def razon_endeudamiento(self, pasivos_totales, activos_totales):
         if activos_totales > 0:
             return pasivos_totales / activos_totales
+        elif np.isnan(activos_totales):
+            return np.nan
         else:
             print('activos totales deben ser mayor 0')
         return 0
@@ -201,171 +1714,217 @@ class Estados:
 
     # ultimo precio de la accion (ultimo precio de cierre)
     def set_precio_actual(self):
-        url= 'https://es.investing.com/equities/' + self.slug
         try:
-            result = httpx.get(url)
-            soup = BeautifulSoup(result.content, 'html.parser')
-            elements = soup.find_all('span')
-            index = 0
-            for i, a in enumerate(elements):
-                # print(str(i) + ':' + a.text)
-                if a.text == 'Último cierre':
-                    index = i + 1
-                    break
-
-            precio = elements[index].text.replace('.', '').replace(',', '.')
+            precio, _ = self.parsear('precio', leer_precio)
             print(str(precio))
             return float(precio)
 
-        except:
-            print("una excepcion ocurrio al intentar leer el precio actual")
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'precio', "una excepcion ocurrio al intentar leer el precio actual") from e
 
     def set_eps_presente(self):
         try:
-            url = "https://www.bolsadesantiago.com:443/api/RV_Instrumentos/getRazonesFinancieras"
-            cookies = {"f5avraaaaaaaaaaaaaaaa_session_": "KOCJLNMPEKADJKFMOACMGBFKAGEPDLKDKPICKGLLONEBGKJLDAOLBJLEEPOLJLLDKLIDDJMIFIMKLJPHHBEACAJCBFAMBJPLPADKGOFEMKFCEODHMNIOGDDLDBGNNBIA", "__uzma": "2e55a4c4-edf7-47e3-bf44-132971d02b14", "__uzmb": "1712783997", "__uzme": "1588", "__uzmc": "3389815783307", "__uzmd": "1712806016", "gb-wbchtbt-uid": "1712784005666", "_csrf": "GEBGUKzB_IHm7-6V_5w_jNtl", "_ga": "GA1.2.1981571046.1712784007", "_gid": "GA1.2.674991874.1712784007", "_ga_Y647MRPM4Z": "GS1.2.1712805991.3.1.1712805991.60.0.0", "__gads": "ID=cad4a9546dad64cb:T=1712784012:RT=1712805983:S=ALNI_MaUktTczhSHoJGS2gRkceCo_7Cj3w", "__gpi": "UID=00000a1bcee3b07b:T=1712784012:RT=1712805983:S=ALNI_MZALrNNF6GkoMrZkzLQhutpDJX4OA", "__eoi": "ID=428dab9e8a7566f8:T=1712784012:RT=1712805983:S=AA-Afjb-MMmAJherJbZRQjv9PRNu", "BIGipServerPool-Push_HTML5_corporativa": "684715681.20480.0000", "BIGipServerPool-www.bolsadesantiago.com-HTML5_corporativa": "718270113.20480.0000", "FCNEC": "%5B%5B%22AKsRol_DlVkNSpdxhMAeR4p1ha_RfGHy3skOSDd2kUCRoIwX3fK2XRvx0cFC_8Euo-n4UK27ayGB5dBFSZ9B61ULHs6ch6sIQgAFUeBcRVRiGreDkhRYqWb1ZABOdDMJ3ZH-5EtvaT3y9f1CSbk-G6GFoNWTGU8CvA%3D%3D%22%5D%5D", "_oauth2_proxy_csrf": "gBTdOJQjqpWcLOdWS9B9CN2C1O52uiOmYmhRaxUvW8Rwb7nKfohbTSUfpA8y15xjfGAUdnxAIipM3KGypnrRyyBzn2yoqCcdatz0azJzUmpeytt52hWF6io=|1712805978|q45Ny1dpkMbKiHctitX2oL9V_P0J4R3AqII7vi-wLvc=", "_gat": "1"}
-            headers = {"User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/113.0", "Accept": "application/json, text/plain, */*", "Accept-Language": "en-US,en;q=0.5", "Accept-Encoding": "gzip, deflate", "Content-Type": "application/json;charset=utf-8", "X-Csrf-Token": "9Q0uqssK-1ews3xi41eCf2XMXKZtxB7OMfwg", "Origin": "https://www.bolsadesantiago.com", "Referer": "https://www.bolsadesantiago.com/resumen_instrumento/ZOFRI", "Sec-Fetch-Dest": "empty", "Sec-Fetch-Mode": "cors", "Sec-Fetch-Site": "same-origin", "Te": "trailers"}
-            data={"ajusteipc": 0, "fecajuste": "", "fecbal": "2024-04-10", "nemo": self.stock_name, "tipobal": "I"}
-            result = requests.post(url, headers=headers, cookies=cookies, json=data)
-            json_string = result.text
-            json_loaded = json.loads(json_string)
-            eps = json_loaded["listaResult"][1]['VALOR01']
-            # print(eps)
-            return float(eps)
-        except:
-            print("una excepcion ocurrio al intentar leer el EPS presente")
+            return self.parsear('eps', leer_eps)[0]
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'eps', "una excepcion ocurrio al intentar leer el EPS presente") from e
 
      # lista con los ultimos 4 años de activo circulante
+    @memoizado('balances')
     def total_activo_circulante(self):
-        return get_annual_data(self.balances,1,2,3,4)
+        return self.balances.fila('Total activo circulante', 'Total activos circulantes', 'Total Current Assets').tolist()
 
 
     # lista con los ultimos 4 años de pasivo circulante
+    @memoizado('balances')
     def total_pasivo_circulante(self):
-        return get_annual_data(self.balances,103,104,105,106)
+        return self.balances.fila('Total pasivo circulante', 'Total pasivos circulantes', 'Total Current Liabilities').tolist()
 
 
     # lista con los ultimos 4 años de inventario (existencias)
+    @memoizado('balances')
     def total_inventario(self):
-        return get_annual_data(self.balances,37,38,39,40)
+        return self.balances.fila('Total inventario', 'Total Inventory', faltante=0).tolist()
 
 
+    @memoizado('balances')
     def pasivos_totales(self):
-        return get_annual_data(self.balances,139,140,141,142)
+        return self.balances.fila('Total pasivo', 'Total pasivos', 'Total Liabilities').tolist()
 
 
+    @memoizado('balances')
     def activos_totales(self):
-        return get_annual_data(self.balances,52,53,54,55)
+        return self.balances.fila('Total activos', 'Total activo', 'Total Assets').tolist()
 
 
+    @memoizado('balances')
     def patrimonio_neto(self):
-        return get_annual_data(self.balances,175,176,177,178)
+        return self.balances.fila('Total patrimonio', 'Total patrimonio neto', 'Total Equity').tolist()
 
 
+    @memoizado('resultados')
     def total_ingresos(self):
-        return get_annual_data(self.resultados, 1, 2, 3, 4)
+        return self.resultados.fila('Ingresos totales', 'Total Revenue').tolist()
 
 
+    @memoizado('resultados')
     def total_margen_bruto(self):
-        return get_annual_data(self.resultados, 22, 23, 24, 25)
+        return self.resultados.fila('Beneficio bruto', 'Gross Profit').tolist()
 
 
+    @memoizado('resultados')
     def total_costo_venta(self):
-        return get_annual_data(self.resultados, 27, 28, 29, 30)
+        return self.resultados.fila('Total de gastos de explotación', 'Total de gastos operativos', 'Total Operating Expenses').tolist()
 
 
 
+    @memoizado('resultados')
     def total_resultado_explotacion(self):
-        return get_annual_data(self.resultados, 63, 64, 65, 66)
+        return self.resultados.fila('Ingresos de explotación', 'Ingresos operativos', 'Operating Income').tolist()
 
 
     # utilidad neta
+    @memoizado('resultados')
     def total_resultado_ejercicio(self):
-        return get_annual_data(self.resultados, 143, 144, 145, 146)
+        return self.resultados.fila('Ingresos netos diluidos', 'Beneficio neto diluido', 'Diluted Net Income').tolist()
 
 
+    @memoizado('resultados')
     def total_beneficio_por_accion(self):
-        return get_annual_data(self.resultados,163,164,165,166)
+        return self.resultados.fila('BPA normalizado diluido', 'Diluted Normalized EPS').tolist()
 
 
+    @memoizado('resultados')
     def total_dividendos_por_accion(self):
-        return get_annual_data(self.resultados,158,159,160,161)
+        return self.resultados.fila(*etiquetas_dpa, faltante=0).tolist()
 
+    @memoizado('flujos_caja')
     def total_free_cash_flow(self):
-        return get_annual_data(self.flujos_caja,119,120,121,122)
+        return self.flujos_caja.fila('Flujo de caja libre', 'Free Cash Flow').tolist()
 
 
+    @memoizado('balances')
     def acciones_circulando(self):
-        accionesComunes = get_annual_data(self.balances,231,232,233,234)
-        accionesPreferidas = get_annual_data(self.balances,236,237,238,239)
-        return [ a + accionesPreferidas[i] for i, a in enumerate(accionesComunes)]
+        accionesComunes = self.balances.fila('Total de acciones ordinarias en circulación', 'Total Common Shares Outstanding')
+        accionesPreferidas = self.balances.fila('Total de acciones preferentes en circulación', 'Total Preferred Shares Outstanding',
+            faltante=0)
+        return (accionesComunes + accionesPreferidas).tolist()
 
 
+    @memoizado('balances')
     def total_efectivo_e_inversiones(self):
-        total_arr = self.balances[5].text.splitlines()
-        total = [ t for i,t in enumerate(total_arr)  if i in [14,15,16,17] ]
-        return [ 0 if u == '-' else float(u.replace(",", ".").strip('%')) for u in total ]
+        return self.balances.fila('Efectivo e inversiones a corto plazo', 'Cash and Short Term Investments').tolist()
+
+
+    @memoizado('resultados')
+    def total_beneficio_diluido(self):
+        return self.resultados.fila('BPA diluido excluyendo partidas extraordinarias', 'Diluted EPS Excluding Extraordinary Items').tolist()
 
 
+    @memoizado('resultados')
     def total_DPS_EPS(self):
-        totalBeneficio  = get_annual_data(self.resultados,153,154,155,156)
-        totalDividendos = get_annual_data(self.resultados,158,159,160,161)
-        return [ round(d / totalBeneficio[i], 2) if totalBeneficio[i] > 0  else 0 for i, d in enumerate(totalDividendos)]
+        totalBeneficio  = self.total_beneficio_diluido()
+        totalDividendos = self.total_dividendos_por_accion()
+        return [ round(d / totalBeneficio[i], 2) if totalBeneficio[i] > 0  else np.nan if np.isnan(totalBeneficio[i]) else 0
+            for i, d in enumerate(totalDividendos)]
 
 
+    @memoizado('balances')
     def valor_libro_ajustado(self):
         accionesCirculando = self.acciones_circulando()
         patrimonioNeto = self.patrimonio_neto()
-        return [ round(patrimonioNeto[i] / a, 2) if a > 0 else 0 for i, a in enumerate(accionesCirculando)]
+        return [ round(patrimonioNeto[i] / a, 2) if a > 0 else np.nan if np.isnan(a) else 0 for i, a in enumerate(accionesCirculando)]
 
 
+    @memoizado('balances')
     def total_test_acido(self):
         return array_calculations(self.total_activo_circulante, self.total_pasivo_circulante,
             self.razon_corriente, self.total_inventario)
 
 
+    @memoizado('balances')
     def total_capital_trabajo(self):
         return array_calculations(self.total_activo_circulante, self.total_pasivo_circulante, self.capital_de_trabajo)
 
 
+    @memoizado('balances')
     def total_razon_corriente(self):
         return array_calculations(self.total_activo_circulante, self.total_pasivo_circulante, self.razon_corriente)
 
 
+    @memoizado('balances')
     def total_razon_endeudamiento(self):
         return array_calculations(self.pasivos_totales, self.activos_totales, self.razon_endeudamiento)
 
 
+    @memoizado('balances')
     def total_razon_deuda_patrimonio(self):
         return array_calculations(self.pasivos_totales, self.patrimonio_neto, self.razon_endeudamiento)
 
 
+    # años de los periodos, segun el encabezado del balance (el mas reciente primero)
+    def anios(self):
+        return anios_periodos(self.balances.periodos)
+
+
+    # razon de crecimiento de varias series de Estados en una sola resolucion, cada una con los años de su estado
+    # (en modo historico el balance y los resultados pueden tener distintos periodos guardados)
+    def crecimientos(self, series):
+        with perfil.medir(self.stock_name, 'compute', 'crecimientos'):
+            return self.calcular_crecimientos(series)
+
+
+    def calcular_crecimientos(self, series):
+        anios = [ anios_periodos(getattr(self, getattr(Estados, serie).fuentes[0]).periodos) for serie in series ]
+        columnas = max(len(a) for a in anios)
+        x = np.full((len(series), columnas), np.nan)
+        y = np.full((len(series), columnas), np.nan)
+        for i, serie in enumerate(series):
+            datos = getattr(self, serie)()[:len(anios[i])]
+            x[i, :len(anios[i])] = anios[i]
+            y[i, :len(datos)] = datos
+        return dict(zip(series, razones_crecimiento(y, x).tolist()))
+
+
+    # razon de crecimiento de una serie de Estados, ej: b.crecimiento('activos_totales')
+    @memoizado('balances', 'resultados', 'flujos_caja')
+    def crecimiento(self, serie):
+        return self.crecimientos([serie])[serie]
+
+
     def check_test_acido(self):
         totalTestAcido = self.total_test_acido()
-        mean = np.mean(totalTestAcido)
+        mean = promedio(totalTestAcido)
         print(round(mean, 2))
-        print_bool_result(mean >= 1)
+        resultado = veredicto(mean, lambda m: m >= 1)
+        print_bool_result(resultado)
+        return resultado
 
 
     def check_capital_trabajo(self):
         totalCapitalTrabajo = self.total_capital_trabajo()
-        mean = np.mean(totalCapitalTrabajo)
+        mean = promedio(totalCapitalTrabajo)
         print(round(mean, 2))
-        print_bool_result(mean > 0)
+        resultado = veredicto(mean, lambda m: m > 0)
+        print_bool_result(resultado)
+        return resultado
 
 
     def check_razon_corriente(self):
         totalRazonCorriente = self.total_razon_corriente()
-        mean = np.mean(totalRazonCorriente)
+        mean = promedio(totalRazonCorriente)
         print(round(mean, 2))
-        print_bool_result(mean >= 1)
+        resultado = veredicto(mean, lambda m: m >= 1)
+        print_bool_result(resultado)
+        return resultado
 
 
     def check_razon_endeudamiento(self):
         totalRazonEndeudamiento = self.total_razon_endeudamiento()
-        mean = np.mean(totalRazonEndeudamiento)
+        mean = promedio(totalRazonEndeudamiento)
         print(round(mean, 2))
-        print_bool_result(mean <= 0.5)
+        resultado = veredicto(mean, lambda m: m <= 0.5)
+        print_bool_result(resultado)
+        return resultado
 
 
     # Actividad operacional
@@ -404,71 +1963,54 @@ class Estados:
         return round((activo_circulante - total_efectivo) / costo_venta, 2) if costo_venta > 0 else 0
 
 
-    # estado resultado los ultimos 4 años
+    # estado resultado los ultimos 4 años (con trimestres, sumas TTM)
     def set_estado_resultado(self):
-        url= base_url + self.stock_id + '&report_type=INC&period_type=' + self.period_type
         try:
-            result = httpx.get(url)
-            soup = BeautifulSoup(result.content, 'html.parser')
-            return soup.find_all('td')
-        except:
-            print("una excepcion ocurrio al intentar leer el estado resultado")
+            return self.leer_flujos('INC', 'resultados')
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'INC', "una excepcion ocurrio al intentar leer el estado resultado") from e
 
 
     # ratios
     def set_ratios(self):
-        url= 'https://es.investing.com/equities/' + self.slug + '-ratios'
         try:
-            result = httpx.get(url)
-            soup = BeautifulSoup(result.content, 'html.parser')
-            return soup.find_all('td')
-        except:
-            print("una excepcion ocurrio al intentar leer los ratios")
+            return self.parsear('ratios', leer_ratios)[0]
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'ratios', "una excepcion ocurrio al intentar leer los ratios") from e
 
 
-    # flujos de caja
+    # flujos de caja (con trimestres, sumas TTM)
     def set_flujos_caja(self):
-        # cambiando a anualizado
-        with httpx.Client() as client:
-            url= base_url + self.stock_id + '&report_type=CAS&period_type=' + self.period_type
-            result = client.get(url)
-            soup = BeautifulSoup(result.content, 'html.parser')
-            return soup.find_all('td')
+        try:
+            return self.leer_flujos('CAS', 'flujos_caja')
+        except Exception as e:
+            raise ErrorDocumento(self.stock_name, 'CAS', "una excepcion ocurrio al intentar leer los flujos de caja") from e
 
 
     # (AC-Caja) / Ventas
+    @memoizado('balances', 'resultados')
     def total_casanegra_ratio(self):
         return array_calculations(self.total_activo_circulante,
             self.total_efectivo_e_inversiones, self.casanegra_ratio, self.total_costo_venta)
 
 
+    @memoizado('resultados')
     def total_margen_bruto_calculado(self):
         totalIngresos = self.total_ingresos()
         costoVenta = self.total_costo_venta()
-        return [ round(self.margen_bruto(t, costoVenta[i]), 2) for i, t in enumerate(totalIngresos)]
+        return [ np.nan if np.isnan(t) else round(self.margen_bruto(t, costoVenta[i]), 2) for i, t in enumerate(totalIngresos)]
 
 
     # Rentabilidad sobre el capital (equity) 5YA
+    @memoizado('ratios')
     def set_ROE(self):
-        index = 0
-        for i, r in enumerate(self.ratios):
-            # print(str(i) + ':' + r.text)
-            if 'Rentabilidad sobre la inversión 5YA' in r.text:
-                index = i + 1
-
-        return convert(self.ratios[index])
+        return self.ratios.valor('Rentabilidad sobre la inversión 5YA')
 
 
     # tasa de reparto (payout ratio) 5YA  (buena entre 50 y 70 %)
+    @memoizado('ratios')
     def set_tasa_reparto(self):
-        index = 0
-        for i, r in enumerate(self.ratios):
-            # print(str(i) + ':' + r.text)
-            if 'Ratio Payout TTM' == r.text:
-                index = i + 1
-                break
-
-        result = convert(self.ratios[index])
+        result = self.ratios.valor('Ratio Payout TTM')
 
         if result < 100.0:
             return result
@@ -486,35 +2028,24 @@ class Estados:
 
 
     # Dividend Yield 5 Year Avg. 5YA
+    @memoizado('ratios')
     def dividend_yield(self):
-        index = 0
-        for i, r in enumerate(self.ratios):
-            # print(str(i) + ':' + r.text)
-            if 'Promedio de Rendimiento del Dividendo en 5 Años 5YA' == r.text:
-                index = i + 1
-                break
-
-        return convert(self.ratios[index])
+        return self.ratios.valor('Promedio de Rendimiento del Dividendo en 5 Años 5YA')
 
 
     # Dividend Growth Rate
+    @memoizado('ratios')
     def dividend_growth_rate(self):
-        index = 0
-        for i, r in enumerate(self.ratios):
-            # print(str(i) + ':' + r.text)
-            if 'Tasa de Crecimiento de los Dividendos ANN' == r.text:
-                index = i + 1
-                break
-
-        return convert(self.ratios[index])
+        return self.ratios.valor('Tasa de Crecimiento de los Dividendos ANN')
 
 
     # FCF/ Patrimonio para todos los años.
+    @memoizado('balances', 'flujos_caja')
     def fcf_patrimonio(self):
         patrimonioNeto = self.patrimonio_neto()
         freeCash = self.total_free_cash_flow()
         return [ round(100 * (f / patrimonioNeto[i]) , 2)
-            if patrimonioNeto[i] > 0 else 0 for i,f in enumerate(freeCash)]
+            if patrimonioNeto[i] > 0 else np.nan if np.isnan(patrimonioNeto[i]) else 0 for i,f in enumerate(freeCash)]
 
 
     # tipo de empresa por tasa de crecimiento
@@ -534,10 +2065,9 @@ class Estados:
         return round(self.ROE * (1 - (self.tasa_reparto / 100)), 2)
 
 
-    # promedio a 5 años
+    # promedio a 5 años, sin los periodos que faltan (NaN en el historico o en las series TTM)
     def set_eps_promedio(self):
-        eps_s = self.total_beneficio_por_accion()
-        return np.mean(eps_s)
+        return promedio(self.total_beneficio_por_accion())
 
     # usando eps presente
     def set_eps_futuro(self, n):
@@ -554,27 +2084,41 @@ class Estados:
             - 1 + (self.tasa_dividendos/100) * (1 - impuesto_dividendo)), 2)
 
 
+    def precio_presente_calculado(self):
+        return self.precio_accion_futuro / (1 + (self.g / 100))**(self.n)
+
+
     # margen de seguridad tipico : 15 %
+    def precio_presente_ajustado(self, margenSeguridad):
+        return (1 - (margenSeguridad / 100)) * self.precio_presente_calculado()
+
+
+    def comprar_casanegra(self, margenSeguridad):
+        return self.precio_actual <= self.precio_presente_ajustado(margenSeguridad)
+
+
     def analisis_casanegra(self, margenSeguridad):
-        precioPresente =  self.precio_accion_futuro / (1 + (self.g / 100))**(self.n)
+        precioPresente = self.precio_presente_calculado()
         print('--------------------------------')
         print('precio presente calculado: ')
         print(round(precioPresente, 2))
         print('')
 
-        precioAjustado = (1 - (margenSeguridad / 100)) * precioPresente
+        precioAjustado = self.precio_presente_ajustado(margenSeguridad)
 
         print('precio presente calculado con margen de seguridad de ' + str(margenSeguridad) + '(%): ')
         print(round(precioAjustado, 2))
         print('')
 
-        if self.precio_actual <= precioAjustado:
+        comprar = self.comprar_casanegra(margenSeguridad)
+        if comprar:
             print('[+] Comprar! precio actual en bolsa < precio presente ajustado')
         else:
             print('[+] Esperar, precio actual en bolsa > precio presente ajustado')
 
         print('--------------------------------')
         print('')
+        return comprar
 
 
     """
@@ -582,17 +2126,31 @@ class Estados:
       Utilidad de explotación = ingresos - gastos de explotación
       Utilidad bruta = ingresos - costos de explotación
     """
-    def grafico_amigo(self):
+    # ruta: archivo .png o .svg donde guardar el grafico sin abrir ventana, si no viene se muestra con plt.show()
+    def grafico_amigo(self, ruta=None):
+        # Figure sin pyplot: se dibuja con el backend no interactivo (Agg/SVG) y no bloquea en procesos batch
+        if ruta:
+            from matplotlib.figure import Figure
+            figura = Figure()
+        else:
+            import matplotlib.pyplot as plt
+            figura = plt.figure()
+        ejes = figura.add_subplot()
+
         totalExplotacion = self.total_resultado_explotacion()
         totalFCF = self.total_free_cash_flow()
-        years = np.array([2019, 2020, 2021, 2022])
-        plt.plot(years,np.array(totalExplotacion[::-1]), label="resultado explotacion")
-        plt.plot(years,np.array(totalFCF[::-1]), label="free cash flow")
-        plt.legend()
-        plt.xlabel('años')
-        plt.ylabel('$')
-        plt.title('Grafico amigo ')
-        plt.show()
+        # fechas de cierre de cada estado, del periodo mas antiguo al mas reciente
+        ejes.plot(self.resultados.periodos[::-1], np.array(totalExplotacion[::-1]), label="resultado explotacion")
+        ejes.plot(self.flujos_caja.periodos[::-1], np.array(totalFCF[::-1]), label="free cash flow")
+        ejes.legend()
+        ejes.set_xlabel('años')
+        ejes.set_ylabel('$')
+        ejes.set_title('Grafico amigo ')
+
+        if ruta:
+            figura.savefig(ruta)
+        else:
+            plt.show()
 
 
     def check_valor_bolsa_libro(self):
@@ -605,40 +2163,44 @@ class Estados:
 
 
     # precio / valor contable  (valor bolsa/libro)
+    @memoizado('ratios')
     def set_precio_valor_contable(self):
-        index = 0
-        for i, r in enumerate(self.ratios):
-        # print(str(i) + ':' + r.text)
-            if 'Precio/Valor Contable MRQ' in r.text:
-                index = i + 1
-        # print('valor BOLSA/LIBRO:' + ratios[index].text)
-
-        return convert(self.ratios[index])
+        return self.ratios.valor('Precio/Valor Contable MRQ')
 
 
-    # tomando eps promedio de 5A
+    # tomando eps promedio de 5A (como eps_promedio, sin los periodos que faltan)
     def earning_yield(self):
-        epsMean = np.mean(self.total_beneficio_por_accion())
+        epsMean = promedio(self.total_beneficio_por_accion())
         return round(100 * (epsMean /  self.precio_actual), 2)
 
     def graham_ratio(self):
        return self.per * self.precio_valor_contable
 
+    # graham maximo aceptable segun el ROE
+    def limite_graham(self):
+        if self.ROE <= 10:
+            return 10
+        elif self.ROE <= 15:
+            return 15
+        else:
+            return 22.5
+
+    def comprar_multiplos_cruzados(self):
+        return round(self.graham_ratio(), 2) <= self.limite_graham()
+
     def criterio_multiplos_cruzados(self):
        graham =  round(self.graham_ratio(),2)
        print('graham: '+ str(graham))
 
-       if self.ROE <= 10 and graham <= 10:
-           print('comprar la acción, graham menor a 10')
-       elif self.ROE > 10 and self.ROE <= 15  and graham <= 15:
-           print('comprar la acción, graham menor a 15')
-       elif self.ROE > 15 and graham <= 22.5:
-           print('comprar la acción, graham menor a 22.5')
+       comprar = self.comprar_multiplos_cruzados()
+       if comprar:
+           print('comprar la acción, graham menor a ' + str(self.limite_graham()))
        else:
            print('no comprar, la acción sigue cara')
 
        print('--------------------------------')
        print('')
+       return comprar
 
     # multiplo de per (g en %)
     def get_multiplo_per(self):
@@ -657,6 +2219,20 @@ class Estados:
         return self.ratios
 
 
+    # cualquier ratio de la pagina, ej: b.get_ratio('Margen operativo TTM')
+    def get_ratio(self, etiqueta, industria=False):
+        return self.ratios.valor(etiqueta, industria=industria)
+
+
+    # razon corriente del ultimo trimestre segun investing.com
+    def get_ratio_corriente(self):
+        return self.ratios.valor('Ratio corriente MRQ', 'Current Ratio MRQ')
+
+
+    def get_margen_operativo(self):
+        return self.ratios.valor('Margen operativo TTM', 'Operating margin TTM')
+
+
     def get_estado_resultado(self):
         return self.resultados
 
@@ -730,17 +2306,1018 @@ class Estados:
         return self.stock_name
 
 
+# un Estados por period_type de la misma empresa, con los documentos de descargar_empresa (period_type -> documentos)
+# o sus tablas de parsear_empresa; el trimestral usa el anual para los campos comunes y para completar sus series
+def estados_empresa(stock_name, period_types, n, documentos=None, cliente=None, almacen=almacen_estados, historico=False,
+        tablas=None):
+    estados = {}
+    for p in sorted(period_types, key=lambda p: p != 'Annual'):
+        anual = estados.get('Annual') if p == 'Interim' else None
+        estados[p] = Estados(stock_name, p, n, (documentos or {}).get(p), cliente, almacen, historico, anual,
+            (tablas or {}).get(p))
+    return { p: estados[p] for p in period_types }
+
+
+# partidas de Estados que usa MatrizRatios
+partidas_ratios = ('total_activo_circulante', 'total_pasivo_circulante', 'total_inventario', 'pasivos_totales',
+    'activos_totales', 'patrimonio_neto', 'total_efectivo_e_inversiones', 'total_costo_venta', 'total_ingresos',
+    'total_free_cash_flow', 'acciones_circulando', 'total_dividendos_por_accion', 'total_beneficio_diluido',
+    'total_margen_bruto', 'total_resultado_explotacion', 'total_resultado_ejercicio', 'total_beneficio_por_accion')
+
+
+# partidas de una empresa y, en 'anios', los años de los periodos de cada estado del que salen (estado -> años: en
+# modo historico el balance y los resultados pueden tener distintos periodos); fuentes: solo las partidas de esos
+# estados (ej: ('balances',))
+def partidas_empresa(b, fuentes=None):
+    partidas = [ p for p in partidas_ratios if fuentes is None or getattr(Estados, p).fuentes[0] in fuentes ]
+    estados = dict.fromkeys(getattr(Estados, p).fuentes[0] for p in partidas)
+    return dict({ partida: getattr(b, partida)() for partida in partidas },
+        anios={ estado: anios_periodos(getattr(b, estado).periodos).tolist() for estado in estados })
+
+
+# criterio -> (partida, True si debe crecer / False si debe mantenerse o disminuir)
+criterios_crecimiento = {
+    'activos_crecientes':    ('activos_totales', True),
+    'patrimonio_creciente':  ('patrimonio_neto', True),
+    'acciones_constantes':   ('acciones_circulando', False),
+    'ingresos':              ('total_ingresos', True),
+    'margen_bruto':          ('total_margen_bruto', True),
+    'resultado_explotacion': ('total_resultado_explotacion', True),
+    'utilidad_neta':         ('total_resultado_ejercicio', True),
+    'eps':                   ('total_beneficio_por_accion', True),
+}
+
+
+# promedio de cada fila sin los periodos que faltan (NaN); NaN si a la fila no le queda ninguno
+def promedio_filas(matriz):
+    validos = ~np.isnan(matriz)
+    cantidad = validos.sum(axis=1)
+    return np.divide(np.where(validos, matriz, 0).sum(axis=1), cantidad, out=np.full(len(matriz), np.nan), where=cantidad > 0)
+
+
+# veredicto de un criterio para cada valor de un vector
+def veredictos(valores, cumple):
+    return [ veredicto(v, cumple) for v in valores ]
+
+
+# division elemento a elemento: 0 donde el denominador no es positivo, NaN donde falta el dato
+def division_enmascarada(numerador, denominador):
+    resultado = np.zeros(np.broadcast(numerador, denominador).shape)
+    np.divide(numerador, denominador, out=resultado, where=denominador > 0)
+    resultado[np.isnan(numerador) | np.isnan(denominador)] = np.nan
+    return resultado
+
+
+"""
+  Ratios de balance y estado resultado de muchas empresas a la vez. Cada partida se apila en una matriz
+  empresas x periodos (float64, NaN donde una empresa tiene menos periodos) y cada ratio es una sola operacion
+  vectorizada. Los valores son los mismos que entregan los metodos total_* de Estados para cada empresa.
+"""
+class MatrizRatios:
+    # criterio del balance -> como se calcula, con el promedio de los periodos (sin veredicto si no hay ninguno)
+    criterios_balance = {
+        'capital_trabajo':     lambda m: veredictos(promedio_filas(m.capital_trabajo()), lambda v: v > 0),
+        'razon_corriente':     lambda m: veredictos(promedio_filas(m.razon_corriente()), lambda v: v >= 1),
+        'test_acido':          lambda m: veredictos(promedio_filas(m.test_acido()), lambda v: v >= 1),
+        'razon_endeudamiento': lambda m: veredictos(promedio_filas(m.razon_endeudamiento()), lambda v: v <= 0.5),
+    }
+
+    # partidas: ticker -> partidas_empresa(b); una partida que no viene queda en NaN
+    def __init__(self, partidas):
+        self.tickers = list(partidas)
+        largo = max([ len(serie) for p in partidas.values() for nombre, serie in p.items() if nombre != 'anios' ]
+            + [ len(anios) for p in partidas.values() for anios in p['anios'].values() ] + [0])
+        self.matrices = {}
+        for partida in partidas_ratios:
+            matriz = np.full((len(self.tickers), largo), np.nan)
+            for i, ticker in enumerate(self.tickers):
+                serie = partidas[ticker].get(partida, [])
+                matriz[i, :len(serie)] = serie
+            self.matrices[partida] = matriz
+
+        # estado -> años de sus periodos, empresas x periodos
+        self.anios = {}
+        for i, ticker in enumerate(self.tickers):
+            for estado, anios in partidas[ticker]['anios'].items():
+                matriz = self.anios.setdefault(estado, np.full((len(self.tickers), largo), np.nan))
+                matriz[i, :len(anios)] = anios
+
+
+    def __getitem__(self, partida):
+        return self.matrices[partida]
+
+
+    # años de los periodos del estado del que sale la partida (NaN si ninguna empresa lo trae)
+    def anios_partida(self, partida):
+        estado = getattr(Estados, partida).fuentes[0]
+        return self.anios.get(estado, np.full(self[partida].shape, np.nan))
+
+
+    def capital_trabajo(self):
+        return np.round(self['total_activo_circulante'] - self['total_pasivo_circulante'], 2)
+
+
+    def razon_corriente(self):
+        return np.round(division_enmascarada(self['total_activo_circulante'], self['total_pasivo_circulante']), 2)
+
+
+    def test_acido(self):
+        return np.round(division_enmascarada(self['total_activo_circulante'] - self['total_inventario'], self['total_pasivo_circulante']), 2)
+
+
+    def razon_endeudamiento(self):
+        return np.round(division_enmascarada(self['pasivos_totales'], self['activos_totales']), 2)
+
+
+    def razon_deuda_patrimonio(self):
+        return np.round(division_enmascarada(self['pasivos_totales'], self['patrimonio_neto']), 2)
+
+
+    # (AC-Caja) / Ventas
+    def casanegra_ratio(self):
+        return np.round(division_enmascarada(self['total_activo_circulante'] - self['total_efectivo_e_inversiones'], self['total_costo_venta']), 2)
+
+
+    def margen_bruto_calculado(self):
+        return np.round(division_enmascarada(100 * (self['total_ingresos'] - self['total_costo_venta']), self['total_ingresos']), 2)
+
+
+    def dps_eps(self):
+        return np.round(division_enmascarada(self['total_dividendos_por_accion'], self['total_beneficio_diluido']), 2)
+
+
+    def valor_libro_ajustado(self):
+        return np.round(division_enmascarada(self['patrimonio_neto'], self['acciones_circulando']), 2)
+
+
+    def fcf_patrimonio(self):
+        return np.round(100 * division_enmascarada(self['total_free_cash_flow'], self['patrimonio_neto']), 2)
+
+
+    # una fila de la matriz por empresa, sin los periodos que faltan
+    def por_empresa(self, matriz):
+        return { ticker: [ float(v) for v in matriz[i] if not np.isnan(v) ] for i, ticker in enumerate(self.tickers) }
+
+
+    # razon de crecimiento de una partida para cada empresa, con sus propios años
+    def crecimiento(self, partida):
+        return razones_crecimiento(self[partida], self.anios_partida(partida))
+
+
+    """
+      Criterios del balance y del estado resultado para todas las empresas: 1 a 4 del balance con el promedio
+      de los periodos, el resto con las razones de crecimiento de todas las partidas resueltas en una sola llamada.
+      Cada criterio es True, False o None si la empresa no tiene los datos (ej: una partida que no esta en su estado).
+      nombres: solo esos criterios (ej: los que se pueden evaluar con las partidas que hay), por defecto todos.
+    """
+    def criterios(self, nombres=None):
+        with perfil.medir('(todas)', 'compute', 'criterios'):
+            return self.calcular_criterios(nombres)
+
+
+    def calcular_criterios(self, nombres=None):
+        nombres = nombres or list(MatrizRatios.criterios_balance) + list(criterios_crecimiento)
+        criterios = { c: MatrizRatios.criterios_balance[c](self) for c in nombres if c in MatrizRatios.criterios_balance }
+
+        crecimiento = [ c for c in nombres if c in criterios_crecimiento ]
+        if crecimiento:
+            series = np.vstack([ self[criterios_crecimiento[c][0]] for c in crecimiento ])
+            anios = np.vstack([ self.anios_partida(criterios_crecimiento[c][0]) for c in crecimiento ])
+            pendientes = razones_crecimiento(series, anios).reshape(len(crecimiento), len(self.tickers))
+            for criterio, pendiente in zip(crecimiento, pendientes):
+                crece = criterios_crecimiento[criterio][1]
+                criterios[criterio] = veredictos(pendiente, (lambda v: v > 0) if crece else (lambda v: v <= 0))
+
+        return { ticker: { c: v[i] for c, v in criterios.items() } for i, ticker in enumerate(self.tickers) }
+
+
+# criterios del analisis completo (balance, estado resultado y valorizacion) como valores, sin imprimir el detalle
+# criterios: los de MatrizRatios.criterios() ya calculados (el screener los calcula para todas las empresas juntas)
+def evaluar(b, margenSeguridad=15, impuesto_dividendo=0, criterios=None):
+    if criterios is None:
+        criterios = MatrizRatios({ b.stock_name: partidas_empresa(b) }).criterios()[b.stock_name]
+
+    return dict(criterios, **{ c: calculo(b, margenSeguridad, impuesto_dividendo) for c, calculo in criterios_valorizacion.items() })
+
+
+# criterios de evaluar que no salen de MatrizRatios: criterio -> como se calcula (b, margenSeguridad, impuesto_dividendo)
+criterios_valorizacion = {
+    # estado resultado
+    'roe':                   lambda b, m, i: bool(round(b.ROE, 2) > 15.0),
+    # valorizacion
+    'rentabilidad':          lambda b, m, i: b.rentabilidad_capital(i),
+    'casanegra':             lambda b, m, i: bool(b.g > 0 and b.comprar_casanegra(m)),
+    'multiplos_cruzados':    lambda b, m, i: bool(b.comprar_multiplos_cruzados()),
+}
+
+
+# criterio -> campos hoja de Estados que necesita (cada crecimiento solo el estado de su partida, con sus propios años)
+hojas_criterio = dict(
+    { c: ('balances',) for c in MatrizRatios.criterios_balance },
+    **{ c: (getattr(Estados, partida).fuentes[0],) for c, (partida, _) in criterios_crecimiento.items() },
+    roe=('ratios',),
+    rentabilidad=('ratios', 'precio_actual', 'eps_presente'),
+    casanegra=('ratios', 'precio_actual', 'eps_presente'),
+    multiplos_cruzados=('ratios', 'precio_actual', 'eps_presente'),
+)
+
+
+# hojas_criterio segun el tipo de periodo: con trimestres los resultados y flujos de caja se alinean a los periodos
+# del balance (leer_flujos), asi que tambien lo necesitan
+def hojas_de_criterio(criterio, period_type='Annual'):
+    hojas = hojas_criterio[criterio]
+    if period_type == 'Interim' and { 'resultados', 'flujos_caja' } & set(hojas):
+        return ('balances',) + hojas
+    return hojas
+
+
+# un solo criterio de evaluar, calculado solo con los estados que necesita (hojas_criterio)
+def evaluar_criterio(b, criterio, margenSeguridad=15, impuesto_dividendo=0):
+    if criterio in criterios_valorizacion:
+        return criterios_valorizacion[criterio](b, margenSeguridad, impuesto_dividendo)
+    partidas = partidas_empresa(b, hojas_criterio[criterio])
+    return MatrizRatios({ b.stock_name: partidas }).criterios([criterio])[b.stock_name][criterio]
+
+
+# series que se exportan en un Resultado, ademas de las partidas de partidas_ratios
+series_resultado = partidas_ratios + ('total_capital_trabajo', 'total_razon_corriente', 'total_test_acido',
+    'total_razon_endeudamiento', 'total_razon_deuda_patrimonio', 'total_margen_bruto_calculado',
+    'total_casanegra_ratio', 'valor_libro_ajustado', 'fcf_patrimonio', 'total_DPS_EPS')
+
+# series de las que se exporta la razon de crecimiento
+crecimientos_resultado = ('activos_totales', 'total_activo_circulante', 'patrimonio_neto', 'acciones_circulando',
+    'total_ingresos', 'total_margen_bruto', 'total_resultado_explotacion', 'total_resultado_ejercicio',
+    'total_beneficio_por_accion', 'total_casanegra_ratio')
+
+# valores de la valorizacion: nombre -> como se calcula
+valores_resultado = {
+    'roe':                   lambda b: b.ROE,
+    'roe_ajustado':          lambda b: b.ROE_ajustado(),
+    'tasa_reparto':          lambda b: b.get_tasa_reparto(),
+    'tasa_crecimiento':      lambda b: b.get_tasa_crecimiento(),
+    'tipo_empresa':          lambda b: b.tipo_empresa(),
+    'eps_futuro':            lambda b: b.get_eps_futuro(),
+    'eps_presente':          lambda b: b.get_eps_presente(),
+    'eps_promedio':          lambda b: b.get_eps_promedio(),
+    'precio_accion_futuro':  lambda b: b.get_precio_accion_futuro(),
+    'precio_actual':         lambda b: b.get_precio_actual(),
+    'precio_presente':       lambda b: round(b.precio_presente_calculado(), 2),
+    'graham':                lambda b: round(b.graham_ratio(), 2),
+    'limite_graham':         lambda b: b.limite_graham(),
+    'precio_valor_contable': lambda b: b.get_precio_valor_contable(),
+    'valor_bolsa_libro':     lambda b: b.check_valor_bolsa_libro(),
+    'per':                   lambda b: b.get_per(),
+    'peg':                   lambda b: b.get_peg(),
+    'earning_yield':         lambda b: b.earning_yield(),
+    'dividend_yield':        lambda b: b.dividend_yield(),
+    'dividend_growth_rate':  lambda b: b.dividend_growth_rate(),
+    'dps_eps_promedio':      lambda b: 100 * round(promedio(b.total_DPS_EPS()), 2),
+}
+
+
+"""
+  Resultado del analisis de una empresa como datos: series por periodo, razones de crecimiento, valores de la
+  valorizacion y criterios (los de evaluar). Si la empresa no se pudo analizar solo trae el error.
+"""
+class Resultado:
+
+    # descartado: el criterio de filtro que no cumplio (ScreenerFiltrado); el analisis se detuvo ahi y solo trae
+    # los criterios evaluados hasta ese
+    def __init__(self, ticker, series=None, crecimientos=None, valores=None, criterios=None, error=None, descartado=None):
+        self.ticker = ticker
+        # nombre -> lista de (periodo 'aaaa-mm-dd', valor), el mas reciente primero
+        self.series = series or {}
+        self.crecimientos = crecimientos or {}
+        self.valores = valores or {}
+        self.criterios = criterios or {}
+        self.error = error
+        self.descartado = descartado
+
+    def como_dict(self):
+        if self.error is not None:
+            return { 'ticker': self.ticker, 'error': self.error }
+        if self.descartado is not None:
+            return { 'ticker': self.ticker, 'descartado': self.descartado, 'criterios': self.criterios }
+        return {
+            'ticker': self.ticker,
+            'series': { nombre: [ { 'periodo': p, 'valor': v } for p, v in serie ] for nombre, serie in self.series.items() },
+            'crecimientos': self.crecimientos,
+            'valores': self.valores,
+            'criterios': self.criterios,
+        }
+
+    # formato largo, una fila por dato: (ticker, seccion, nombre, periodo, valor)
+    def filas(self):
+        if self.error is not None:
+            return [ (self.ticker, 'error', 'error', '', self.error) ]
+        filas = [ (self.ticker, 'serie', nombre, p, v) for nombre, serie in self.series.items() for p, v in serie ]
+        if self.descartado is not None:
+            filas.append((self.ticker, 'descartado', self.descartado, '', False))
+        for seccion, valores in (('crecimiento', self.crecimientos), ('valor', self.valores), ('criterio', self.criterios)):
+            filas += [ (self.ticker, seccion, nombre, '', v) for nombre, v in valores.items() ]
+        return filas
+
+
+columnas_exportacion = ['ticker', 'seccion', 'nombre', 'periodo', 'valor']
+
+
+# numeros de numpy a tipos de python, para json/csv/parquet
+def valor_exportable(valor):
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, float) and np.isnan(valor):
+        return None
+    return valor
+
+
+# Resultado de una empresa con todo lo que imprime el analisis completo
+# ticker: nombre del resultado, por defecto el de la empresa (el screener agrega el period_type si analiza varios)
+def resultado_empresa(b, margenSeguridad=15, impuesto_dividendo=0, criterios=None, ticker=None):
+    # algunos calculos avisan por pantalla cuando no aplican (ej: PEG con g <= 0), aqui solo interesa el valor
+    with contextlib.redirect_stdout(io.StringIO()):
+        series = {}
+        for nombre in series_resultado:
+            periodos = getattr(b, getattr(Estados, nombre).fuentes[0]).periodos
+            series[nombre] = [ (p.isoformat(), valor_exportable(v)) for p, v in zip(periodos, getattr(b, nombre)()) ]
+
+        crecimientos = { c: valor_exportable(v) for c, v in b.crecimientos(crecimientos_resultado).items() }
+        valores = { nombre: valor_exportable(calculo(b)) for nombre, calculo in valores_resultado.items() }
+        criterios = evaluar(b, margenSeguridad, impuesto_dividendo, criterios)
+
+    return Resultado(ticker or b.stock_name, series, crecimientos, valores, criterios)
+
+
+def exportar_json(resultados, ruta):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump([ r.como_dict() for r in resultados ], archivo, ensure_ascii=False, indent=2)
+
+
+def exportar_csv(resultados, ruta):
+    with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(columnas_exportacion)
+        for r in resultados:
+            escritor.writerows(r.filas())
+
+
+# requiere pyarrow; el valor se guarda como texto porque mezcla numeros, booleanos y textos
+def exportar_parquet(resultados, ruta):
+    try:
+        pa = importlib.import_module('pyarrow')
+        pq = importlib.import_module('pyarrow.parquet')
+    except ImportError:
+        raise ImportError('exportar a parquet requiere pyarrow (pip install pyarrow)')
+
+    filas = [ f for r in resultados for f in r.filas() ]
+    columnas = { c: [ f[i] for f in filas ] for i, c in enumerate(columnas_exportacion) }
+    columnas['valor'] = [ None if v is None else str(v) for v in columnas['valor'] ]
+    pq.write_table(pa.table(columnas), ruta)
+
+
+formatos_exportacion = {
+    '.json':    exportar_json,
+    '.csv':     exportar_csv,
+    '.parquet': exportar_parquet,
+}
+
+
+# guarda los resultados en `ruta`, el formato sale de la extension (.json, .csv o .parquet)
+def exportar(resultados, ruta):
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension not in formatos_exportacion:
+        raise ValueError('formato de exportacion no soportado: ' + extension + ' (usar ' + ', '.join(formatos_exportacion) + ')')
+    formatos_exportacion[extension](list(resultados), ruta)
+
+
+# ruta del grafico amigo de una empresa dentro de `directorio`
+def ruta_grafico(directorio, ticker, formato='png'):
+    os.makedirs(directorio, exist_ok=True)
+    return os.path.join(directorio, ticker + '_grafico_amigo.' + formato)
+
+
+# proceso de la etapa de parseo: mismo motor html que el proceso principal
+def iniciar_proceso_parseo(motor):
+    global motor_html
+    motor_html = motor
+
+
+# documentos de descargar_empresa (period_type -> documentos) separados en (tablas ya guardadas en cache_parseo,
+# documentos que faltan parsear, huella de cada uno); ratios, precio y EPS una sola vez para todos los period_type.
+# Las lecturas y escrituras de la cache ocurren solo en el proceso principal: los procesos de parseo ejecutan
+# stocks.py como __mp_main__ y solo devuelven datos simples
+def pendientes_parseo(stock_name, documentos):
+    tablas = { period_type: {} for period_type in documentos }
+    faltantes = {}
+    huellas = {}
+    comunes = set()
+    for period_type, docs in documentos.items():
+        for tipo, contenido in docs.items():
+            if tipo in comunes:
+                continue
+            if tipo not in ('BAL', 'INC', 'CAS'):
+                comunes.add(tipo)
+            clave = clave_parseo(stock_name, period_type, tipo)
+            huellas[clave, tipo] = hashlib.sha256(contenido).hexdigest()
+            valor = cache_parseo.leer(tipo, clave, huellas[clave, tipo])
+            if valor is None:
+                faltantes.setdefault(period_type, {})[tipo] = contenido
+            else:
+                cache_parseo.reutilizados[tipo] += 1
+                tablas[period_type][tipo] = valor
+    return tablas, faltantes, huellas
+
+
+# parsea en un proceso de la etapa de parseo los documentos que faltan (period_type -> documentos) y los retorna
+# como datos simples (como_datos). Un documento que no se pudo parsear queda con el error, como texto porque no toda
+# excepcion se puede pasar entre procesos
+def parsear_empresa(documentos):
+    tablas = {}
+    for period_type, docs in documentos.items():
+        tablas[period_type] = {}
+        for tipo, contenido in docs.items():
+            try:
+                tablas[period_type][tipo] = como_datos(lectores[tipo](contenido))
+            except Exception as e:
+                tablas[period_type][tipo] = ValueError(type(e).__name__ + ': ' + str(e))
+    return tablas
+
+
+# agrega a `tablas` lo que volvio de parsear_empresa, guarda en cache_parseo lo que se pudo parsear y copia ratios,
+# precio y EPS a todos los period_type
+def completar_parseo(stock_name, tablas, parseadas, huellas):
+    for period_type, docs in parseadas.items():
+        for tipo, datos in docs.items():
+            cache_parseo.parseados[tipo] += 1
+            if isinstance(datos, Exception):
+                tablas[period_type][tipo] = datos
+                continue
+            clave = clave_parseo(stock_name, period_type, tipo)
+            tablas[period_type][tipo] = desde_datos(datos)
+            cache_parseo.guardar(tipo, clave, huellas[clave, tipo], tablas[period_type][tipo])
+    comunes = { tipo: valor for docs in tablas.values() for tipo, valor in docs.items() if tipo not in ('BAL', 'INC', 'CAS') }
+    for docs in tablas.values():
+        for tipo, valor in comunes.items():
+            docs.setdefault(tipo, valor)
+    return tablas
+
+
+"""
+  Analiza varias empresas en un solo proceso de red, en dos etapas: `workers` corrutinas descargan empresas y las
+  dejan en una cola acotada, de donde la etapa de parseo las toma para parsearlas en otros procesos, un trabajo por
+  proceso a la vez. A esos procesos va el html y vuelven solo las tablas; si el parseo se atrasa la cola se llena y
+  las descargas esperan.
+
+  period_type: 'Annual', 'Interim' o varios (ej: ('Annual', 'Interim')), que por empresa comparten la descarga y el
+  parseo de ratios, precio y EPS; con varios cada resultado queda como '<ticker> <period_type>'
+  graficos: directorio donde guardar el grafico amigo de cada empresa (opcional)
+  client: AsyncClient para las descargas (ej: el de cliente_http.ejecutar), si no viene se crea uno para esta corrida
+  procesos: procesos de la etapa de parseo, por defecto uno por nucleo; con 0 se parsea en este proceso
+  cola_parseo: empresas descargadas que pueden esperar al parseo (por defecto 2 por proceso)
+"""
+async def screener(tickers, period_type='Annual', n=5, workers=8, graficos=None, formato_grafico='png', client=None,
+        procesos=None, cola_parseo=None):
+    if client is None:
+        import httpx
+        async with httpx.AsyncClient() as client:
+            return await screener(tickers, period_type, n, workers, graficos, formato_grafico, client, procesos, cola_parseo)
+
+    procesos = min((os.cpu_count() or 1) if procesos is None else procesos, len(tickers))
+    pool = None
+
+    # el pool se crea con la primera empresa que trae documentos sin parsear: si todas salen de cache_parseo no se
+    # levanta ningun proceso
+    def pool_parseo():
+        nonlocal pool
+        if pool is None:
+            import concurrent.futures
+            import multiprocessing
+            # spawn y no fork: este proceso tiene el hilo del ClienteHttp, y fork con hilos puede dejar candados tomados
+            pool = concurrent.futures.ProcessPoolExecutor(procesos, multiprocessing.get_context('spawn'),
+                iniciar_proceso_parseo, (motor_html,))
+        return pool
+
+    period_types = (period_type,) if isinstance(period_type, str) else tuple(period_type)
+
+    def etiqueta(ticker, p):
+        return ticker if len(period_types) == 1 else ticker + ' ' + p
+
+    cola = asyncio.Queue()
+    for ticker in tickers:
+        cola.put_nowait(ticker)
+
+    parseadores = max(1, procesos)
+    descargadas = asyncio.Queue(cola_parseo or 2 * parseadores)
+
+    resultados = {}
+    estados = {}
+    partidas = {}
+
+    # si una empresa falla se registra el error y se sigue con las demas
+    def fallo(ticker, e):
+        for p in period_types:
+            if etiqueta(ticker, p) not in estados:
+                resultados[etiqueta(ticker, p)] = Resultado(etiqueta(ticker, p), error=type(e).__name__ + ': ' + str(e))
+
+    async def descargar(client):
+        while not cola.empty():
+            ticker = cola.get_nowait()
+            try:
+                documentos = await descargar_empresa(ticker, period_types, client)
+            except Exception as e:
+                fallo(ticker, e)
+                continue
+            # espera aqui si la etapa de parseo va atrasada
+            await descargadas.put((ticker, documentos))
+
+    async def descargas():
+        await asyncio.gather(*[ descargar(client) for _ in range(max(1, min(workers, len(tickers)))) ])
+        for _ in range(parseadores):
+            await descargadas.put((None, None))
+
+    # con procesos=0 el parseo ocurre al extraer las partidas, en este proceso
+    async def parsear():
+        loop = asyncio.get_running_loop()
+        while True:
+            ticker, documentos = await descargadas.get()
+            if ticker is None:
+                return
+            try:
+                tablas = None
+                if procesos > 0:
+                    with perfil.medir(ticker, 'parse', 'procesos', sum(len(c or b'') for d in documentos.values() for c in d.values())):
+                        tablas, faltantes, huellas = pendientes_parseo(ticker, documentos)
+                        parseadas = await loop.run_in_executor(pool_parseo(), parsear_empresa, faltantes) if faltantes else {}
+                        completar_parseo(ticker, tablas, parseadas, huellas)
+                    documentos = None
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for p, b in estados_empresa(ticker, period_types, n, documentos, tablas=tablas).items():
+                        partidas[etiqueta(ticker, p)] = partidas_empresa(b)
+                        estados[etiqueta(ticker, p)] = b
+            except Exception as e:
+                fallo(ticker, e)
+
+    try:
+        await asyncio.gather(descargas(), *[ parsear() for _ in range(parseadores) ])
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # ratios y crecimientos de todas las empresas en una sola pasada
+    criterios = MatrizRatios(partidas).criterios()
+    for nombre, b in estados.items():
+        try:
+            resultados[nombre] = resultado_empresa(b, criterios=criterios[nombre], ticker=nombre)
+            if graficos:
+                b.grafico_amigo(ruta_grafico(graficos, nombre.replace(' ', '_'), formato_grafico))
+        except Exception as e:
+            resultados[nombre] = Resultado(nombre, error=type(e).__name__ + ': ' + str(e))
+
+    return { etiqueta(t, p): resultados[etiqueta(t, p)] for t in tickers for p in period_types }
+
+
+# la salida estandar la comparten el hilo del ClienteHttp, que la silencia mientras calcula, y el principal,
+# que imprime los resultados de ScreenerFiltrado a medida que llegan
+candado_salida = threading.Lock()
+
+
+"""
+  Screener que entrega cada empresa apenas termina, con filtros que se evaluan en orden: para cada criterio de
+  `filtros` se descargan solo los documentos que le faltan a la empresa (hojas_de_criterio) y, si no lo cumple, se
+  descarta sin descargar el resto. Las que pasan todos los filtros se analizan completas. Poner primero los
+  criterios del balance ahorra la pagina de ratios, la del precio y el EPS de la mayoria de las empresas.
+
+  Sin MatrizRatios de todas las empresas juntas ni procesos de parseo: cada empresa se evalua sola al terminar.
+"""
+class ScreenerFiltrado:
+
+    def __init__(self, tickers, filtros=(), period_type='Annual', n=5, workers=8, graficos=None, formato_grafico='png',
+            margenSeguridad=15, impuesto_dividendo=0):
+        self.tickers = list(tickers)
+        self.filtros = list(filtros)
+        self.period_type = period_type
+        self.n = n
+        self.workers = workers
+        self.graficos = graficos
+        self.formato_grafico = formato_grafico
+        self.margenSeguridad = margenSeguridad
+        self.impuesto_dividendo = impuesto_dividendo
+
+        self.inicio = None
+        self.primer_resultado = None
+        self.fin = None
+        self.descartadas = collections.Counter()
+        self.documentos_pedidos = 0
+        self.documentos_ahorrados = 0
+
+
+    # generador asincrono de Resultado, en el orden en que terminan las empresas
+    async def resultados(self, client):
+        self.inicio = time.perf_counter()
+        cola = asyncio.Queue()
+        for ticker in self.tickers:
+            cola.put_nowait(ticker)
+        listos = asyncio.Queue()
+
+        async def worker():
+            while not cola.empty():
+                ticker = cola.get_nowait()
+                try:
+                    resultado = await self.analizar(ticker, client)
+                except Exception as e:
+                    resultado = Resultado(ticker, error=type(e).__name__ + ': ' + str(e))
+                await listos.put(resultado)
+
+        tareas = [ asyncio.ensure_future(worker()) for _ in range(max(1, min(self.workers, len(self.tickers)))) ]
+        try:
+            for _ in self.tickers:
+                resultado = await listos.get()
+                if self.primer_resultado is None:
+                    self.primer_resultado = time.perf_counter()
+                yield resultado
+        finally:
+            self.fin = time.perf_counter()
+            for tarea in tareas:
+                tarea.cancel()
+
+
+    async def analizar(self, ticker, client):
+        b = Estados(ticker, self.period_type, self.n)
+        total = len(Estados.documentos_necesarios(Estados.calculos))
+        criterios = {}
+        for criterio in self.filtros:
+            descargados = await b.descargar(client, *hojas_de_criterio(criterio, self.period_type))
+            self.documentos_pedidos += len(descargados)
+            with candado_salida, contextlib.redirect_stdout(io.StringIO()):
+                criterios[criterio] = evaluar_criterio(b, criterio, self.margenSeguridad, self.impuesto_dividendo)
+            # un criterio sin datos (None) tampoco se cumple
+            if not criterios[criterio]:
+                self.descartadas[criterio] += 1
+                self.documentos_ahorrados += total - len(b.documentos)
+                return Resultado(ticker, criterios=criterios, descartado=criterio)
+
+        descargados = await b.descargar(client)
+        self.documentos_pedidos += len(descargados)
+        with candado_salida, contextlib.redirect_stdout(io.StringIO()):
+            resultado = resultado_empresa(b, self.margenSeguridad, self.impuesto_dividendo)
+            if self.graficos:
+                b.grafico_amigo(ruta_grafico(self.graficos, ticker, self.formato_grafico))
+        return resultado
+
+
+    def metricas(self):
+        total = len(Estados.documentos_necesarios(Estados.calculos)) * len(self.tickers)
+        return {
+            'empresas':               len(self.tickers),
+            'descartadas':            dict(self.descartadas),
+            'documentos_pedidos':     self.documentos_pedidos,
+            'documentos_ahorrados':   self.documentos_ahorrados,
+            'ahorro_pct':             round(100 * self.documentos_ahorrados / total, 1) if total else 0.0,
+            'primer_resultado_s':     round(self.primer_resultado - self.inicio, 3) if self.primer_resultado else None,
+            'total_s':                round(self.fin - self.inicio, 3) if self.fin else None,
+        }
+
+
+"""
+  Cambio de estado de una empresa vigilada: un veredicto de compra que se dio vuelta (tipo 'veredicto', con el
+  criterio y su valor anterior y nuevo) o una consulta de precio que empezo o dejo de fallar (tipo 'error').
+"""
+class Evento:
+
+    def __init__(self, ticker, tipo, criterio=None, antes=None, ahora=None, precio=None, valores=None, error=None):
+        self.hora = time.strftime('%H:%M:%S')
+        self.ticker = ticker
+        self.tipo = tipo
+        self.criterio = criterio
+        self.antes = antes
+        self.ahora = ahora
+        self.precio = precio
+        self.valores = valores or {}
+        self.error = error
+
+    def como_dict(self):
+        return { c: getattr(self, c) for c in ('hora', 'ticker', 'tipo', 'criterio', 'antes', 'ahora', 'precio', 'valores', 'error') }
+
+    def __str__(self):
+        if self.tipo == 'error':
+            return self.hora + ' ' + self.ticker + ' ' + (('error -> ' + self.error) if self.error else 'precio disponible de nuevo')
+        return (self.hora + ' ' + self.ticker + ' ' + self.criterio + ': ' + ('Si' if self.antes else 'No') + ' -> '
+            + ('Si' if self.ahora else 'No') + ' (precio ' + str(self.precio) + ', '
+            + ', '.join(k + ' ' + str(v) for k, v in self.valores.items()) + ')')
+
+
+"""
+  Vigila una lista de empresas durante la rueda: cada Estados se analiza completo una vez y queda en memoria;
+  despues, cada `intervalo` segundos, solo se consulta la pagina de la accion (el precio) y, si cambio, se
+  recalculan solo los campos que dependen del precio (per, graham, PEG y los veredictos casanegra y multiplos
+  cruzados). Los fundamentos (g, eps futuro, precio futuro, P/B) no cambian durante el dia y no se recalculan.
+  Solo se emite un Evento cuando un veredicto se da vuelta.
+"""
+class Vigilante:
+    # veredictos que dependen del precio (de criterios_valorizacion)
+    veredictos = ('casanegra', 'multiplos_cruzados')
+
+    # valores que acompañan al evento: nombre -> como se calcula
+    valores_precio = {
+        'per':    lambda b: b.get_per(),
+        'graham': lambda b: round(b.graham_ratio(), 2),
+        'peg':    lambda b: b.get_peg(),
+    }
+
+    def __init__(self, tickers, intervalo=60.0, period_type='Annual', n=5, workers=8, ciclos=None,
+            margenSeguridad=15, impuesto_dividendo=0):
+        self.tickers = list(tickers)
+        self.intervalo = intervalo
+        self.period_type = period_type
+        self.n = n
+        self.workers = workers
+        self.ciclos = ciclos
+        self.margenSeguridad = margenSeguridad
+        self.impuesto_dividendo = impuesto_dividendo
+        # el precio siempre de la red: con el TTL de la cache se repetiria el mismo precio entre consultas
+        self.cache = CacheHttp(cache_http.directorio, ttl={ 'precio': 0 }, offline=cache_http.offline)
+
+        self.estados = {}
+        self.estado = {}
+        self.errores = {}
+        self.consultas = 0
+        self.recalculos = 0
+        self.ciclo = 0
+
+
+    # veredictos y valores que dependen del precio, sin imprimir nada
+    def evaluar(self, b):
+        with candado_salida, contextlib.redirect_stdout(io.StringIO()):
+            veredictos = { c: criterios_valorizacion[c](b, self.margenSeguridad, self.impuesto_dividendo) for c in self.veredictos }
+            valores = { nombre: valor_exportable(calculo(b)) for nombre, calculo in self.valores_precio.items() }
+        return veredictos, valores
+
+
+    # analisis completo de una empresa; las que fallan quedan fuera de la vigilancia
+    async def cargar(self, ticker, client):
+        b = Estados(ticker, self.period_type, self.n)
+        await b.descargar(client)
+        with candado_salida, contextlib.redirect_stdout(io.StringIO()):
+            b.resolver()
+        self.estados[ticker] = b
+        self.estado[ticker] = self.evaluar(b)[0]
+
+
+    # consulta el precio de una empresa; retorna los eventos que produjo
+    async def refrescar(self, ticker, client):
+        b = self.estados[ticker]
+        self.consultas += 1
+        try:
+            documentos = await descargar_documentos(ticker, self.period_type, client, self.cache, claves=['precio'])
+            contenido = documentos['precio']
+            eventos = [ Evento(ticker, 'error') ] if self.errores.pop(ticker, None) else []
+            if contenido == b.documentos.get('precio'):
+                return eventos
+            precio = float(leer_precio(contenido))
+        except Exception as e:
+            mensaje = type(e).__name__ + ': ' + str(e)
+            anterior = self.errores.get(ticker)
+            self.errores[ticker] = mensaje
+            return [ Evento(ticker, 'error', error=mensaje) ] if anterior is None else []
+
+        b.documentos['precio'] = contenido
+        if precio == b.precio_actual:
+            return eventos
+        b.reemplazar('precio_actual', precio)
+        self.recalculos += 1
+        veredictos, valores = self.evaluar(b)
+        for criterio, ahora in veredictos.items():
+            if ahora != self.estado[ticker][criterio]:
+                eventos.append(Evento(ticker, 'veredicto', criterio, self.estado[ticker][criterio], ahora, precio, valores))
+        self.estado[ticker] = veredictos
+        return eventos
+
+
+    # generador asincrono de Evento; termina despues de `ciclos` consultas (sin ciclos, nunca)
+    async def eventos(self, client):
+        semaforo = asyncio.Semaphore(max(1, self.workers))
+
+        async def limitado(corrutina):
+            async with semaforo:
+                return await corrutina
+
+        cargas = await asyncio.gather(*[ limitado(self.cargar(t, client)) for t in self.tickers ], return_exceptions=True)
+        for ticker, error in zip(self.tickers, cargas):
+            if isinstance(error, Exception):
+                yield Evento(ticker, 'error', error=type(error).__name__ + ': ' + str(error) + ' (no se vigila)')
+
+        while self.ciclos is None or self.ciclo < self.ciclos:
+            inicio = time.monotonic()
+            self.ciclo += 1
+            for eventos in await asyncio.gather(*[ limitado(self.refrescar(t, client)) for t in self.estados ]):
+                for evento in eventos:
+                    yield evento
+            if self.ciclos is None or self.ciclo < self.ciclos:
+                await asyncio.sleep(max(0.0, self.intervalo - (time.monotonic() - inicio)))
+
+
+    def metricas(self):
+        return {
+            'empresas':   len(self.estados),
+            'ciclos':     self.ciclo,
+            'consultas':  self.consultas,
+            'recalculos': self.recalculos,
+            'con_error':  len(self.errores),
+        }
+
+
+columnas_resumen = [
+    ('capital_trabajo', 'CT'), ('razon_corriente', 'RC'), ('test_acido', 'TA'), ('razon_endeudamiento', 'RE'),
+    ('activos_crecientes', 'AC'), ('patrimonio_creciente', 'PC'), ('acciones_constantes', 'NA'),
+    ('ingresos', 'IN'), ('margen_bruto', 'MB'), ('resultado_explotacion', 'RO'), ('utilidad_neta', 'UN'),
+    ('eps', 'EPS'), ('roe', 'ROE'), ('casanegra', 'CN'), ('multiplos_cruzados', 'MC'),
+]
+
+
+def imprimir_encabezado():
+    print('ticker'.ljust(18) + ''.join(e.rjust(5) for _, e in columnas_resumen) + 'rent(%)'.rjust(10))
+
+
+# una empresa descartada por un filtro muestra '-' en los criterios que no se evaluaron, y '?' en los que no tienen datos
+def imprimir_fila(ticker, r):
+    if r.error is not None:
+        print(ticker.ljust(18) + Fore.RED + 'error -> ' + r.error + Style.RESET_ALL)
+        return
+    celdas = [ (Style.RESET_ALL + '-'.rjust(5)) if c not in r.criterios else (Fore.YELLOW + '?'.rjust(5)) if r.criterios[c] is None
+        else (Fore.GREEN + 'Si'.rjust(5)) if r.criterios[c] else (Fore.RED + 'No'.rjust(5)) for c, _ in columnas_resumen ]
+    print(ticker.ljust(18) + ''.join(celdas) + Style.RESET_ALL + str(r.criterios.get('rentabilidad', '-')).rjust(10))
+
+
+def imprimir_leyenda():
+    print('')
+    print('CT: capital de trabajo > 0, RC: razon corriente > 1, TA: test acido > 1, RE: razon endeudamiento < 0.5')
+    print('AC: activos crecientes, PC: patrimonio creciente, NA: acciones constantes o disminuyendo')
+    print('IN: ingresos crecientes, MB: margen bruto creciente, RO: resultado operacional creciente')
+    print('UN: utilidad neta creciente, EPS: EPS creciente, ROE: ROE > 15 %')
+    print('CN: comprar segun analisis casanegra, MC: comprar segun multiplos cruzados')
+    print('?: sin datos para evaluar el criterio')
+    print('')
+
+
+def imprimir_resumen(resultados):
+    imprimir_encabezado()
+    for ticker, r in resultados.items():
+        imprimir_fila(ticker, r)
+    imprimir_leyenda()
+    imprimir_metricas()
+
+
+def imprimir_metricas():
+    print('documentos: ' + cache_parseo.resumen())
+    for host, m in politica_descarga.metricas().items():
+        print(host + ': ' + str(m['pedidos']) + ' pedidos, ' + str(m['pedidos_por_segundo']) + ' pedidos/s, espera media '
+            + str(m['espera_media_ms']) + ' ms (max ' + str(m['espera_maxima_ms']) + ' ms), tasa final ' + str(m['tasa'])
+            + '/s, ' + str(m['limitados']) + ' respuestas 429')
+
+
+# --profile: sin archivo imprime el resumen, con archivo guarda la traza
+def reportar_perfil(destino):
+    if destino == '-':
+        perfil.imprimir_resumen()
+    elif destino:
+        perfil.guardar_traza(destino)
+
+
 # main
 if __name__=="__main__":
 
-    parser = argparse.ArgumentParser(prog="stocks.py", epilog="Fundamental Analisis Script", usage="stocks.py [options] -n <STOCK-NAME>", prefix_chars='-', add_help=True)
-
-    parser.add_argument('-n', action='store', metavar='stock-name', type=str, help='Stock Name.\tExample: AAPL', required=True)
+    parser = argparse.ArgumentParser(prog="stocks.py", epilog="Fundamental Analisis Script", usage="stocks.py [options] -n <STOCK-NAME> | --all | --tickers <A,B,C> | --search <TEXT>", prefix_chars='-', add_help=True)
+
+    seleccion = parser.add_mutually_exclusive_group(required=True)
+    seleccion.add_argument('-n', action='store', metavar='stock-name', type=str, help='Stock Name.\tExample: AAPL')
+    seleccion.add_argument('--all', action='store_true', help='Screen every stock in the registry (empresas.csv or $BRATTIA_EMPRESAS)')
+    seleccion.add_argument('--tickers', action='store', metavar='A,B,C', type=str, help='Screen a comma separated list of stocks')
+    seleccion.add_argument('--search', action='store', metavar='TEXT', type=str, help='List the registry entries matching TEXT (ticker prefix, slug or close spelling) and exit')
+    parser.add_argument('--exchange', action='store', metavar='X,Y', type=str, help='Screen only the stocks of these exchanges (e.g. Santiago, NASDAQ)')
+    parser.add_argument('--sector', action='store', metavar='A,B', type=str, help='Screen only the stocks of these sectors (e.g. financiero, servicios_basicos)')
+    parser.add_argument('-w', '--workers', action='store', metavar='N', type=int, default=8, help='Stocks downloaded at the same time when screening (default: 8)')
+    parser.add_argument('--filters', action='store', metavar='C1,C2', type=str, help='Screen with these criteria first, in order, skipping the remaining downloads of stocks that fail one, and print each stock as soon as it is done (criteria: ' + ', '.join(c for c, _ in columnas_resumen) + ')')
+    parser.add_argument('--watch', action='store_true', help='Keep the stocks in memory, poll only their price and print an event when a buy verdict flips')
+    parser.add_argument('--interval', action='store', metavar='S', type=float, default=60.0, help='Seconds between price polls with --watch (default: %(default)s)')
+    parser.add_argument('--cycles', action='store', metavar='N', type=int, help='Stop --watch after N polls (default: run until interrupted)')
+    parser.add_argument('--parse-workers', action='store', metavar='N', type=int, help='Processes parsing downloaded pages when screening (default: one per CPU, 0 parses in the main process)')
+    parser.add_argument('--parse-queue', action='store', metavar='N', type=int, help='Downloaded stocks that may wait for a parse process before downloads pause (default: 2 per parse process)')
+    parser.add_argument('--parser', action='store', choices=motores_disponibles(), default=motor_html, help='HTML parser engine (default: html.parser)')
+    parser.add_argument('--offline', action='store_true', help='Serve every document from the local cache, without network')
+    parser.add_argument('--base-url', action='store', metavar='URL', type=str, help='Send every request to URL instead of investing.com/bolsadesantiago (e.g. a local mock server)')
+    parser.add_argument('--period', action='store', choices=['Annual', 'Interim', 'both'], default='Annual', help='Annual statements, quarterly statements with trailing-twelve-month flows, or both when screening (default: Annual)')
+    parser.add_argument('--history', action='store_true', help='Analyse every period kept in the local statement store instead of the last 4 downloaded')
+    parser.add_argument('--retries', action='store', metavar='N', type=int, default=politica_descarga.reintentos, help='Retries per request on errors, 429 and 5xx (default: %(default)s)')
+    parser.add_argument('--deadline', action='store', metavar='S', type=float, default=politica_descarga.plazo, help='Seconds to download all documents of a stock (default: %(default)s)')
+    parser.add_argument('--rate', action='store', metavar='R', type=float, default=politica_descarga.tasa, help='Initial requests per second per site, adapted from 429/5xx responses (default: %(default)s)')
+    parser.add_argument('--max-rate', action='store', metavar='R', type=float, default=politica_descarga.tasa_maxima, help='Highest requests per second per site (default: %(default)s)')
+    parser.add_argument('--timeout', action='store', metavar='S', type=float, default=cliente_http.timeout, help='HTTP timeout in seconds (default: %(default)s)')
+    parser.add_argument('--max-connections', action='store', metavar='N', type=int, default=cliente_http.max_conexiones, help='HTTP connection pool size (default: %(default)s)')
+    parser.add_argument('--export', action='store', metavar='FILE', type=str, help='Save every series and verdict to FILE (.json, .csv or .parquet)')
+    parser.add_argument('--charts', action='store', metavar='DIR', type=str, help='Save the grafico amigo to DIR instead of opening a window')
+    parser.add_argument('--chart-format', action='store', choices=['png', 'svg'], default='png', help='Image format for --charts (default: png)')
+    parser.add_argument('--profile', action='store', nargs='?', const='-', metavar='TRACE.json', help='Print per-phase timings per stock, or write them as trace events to TRACE.json')
     parser.add_argument('-v', action='version', version='alpha - v1.0', help='Prints the version of stocks.py')
 
     args = parser.parse_args()
-
-    b = Estados(args.n, 'Annual', 5)
+    if args.export and os.path.splitext(args.export)[1].lower() not in formatos_exportacion:
+        parser.error('--export must end in ' + ', '.join(formatos_exportacion))
+    if args.export and args.export.lower().endswith('.parquet') and importlib.util.find_spec('pyarrow') is None:
+        parser.error('--export to .parquet needs pyarrow (pip install pyarrow)')
+    if args.n and args.period == 'both':
+        parser.error('--period both is only for screening (--all or --tickers)')
+    bolsas = [ v.strip() for v in (args.exchange or '').split(',') if v.strip() ]
+    sectores = [ v.strip() for v in (args.sector or '').split(',') if v.strip() ]
+    if (bolsas or sectores) and not (args.all or args.tickers):
+        parser.error('--exchange and --sector narrow --all or --tickers')
+    for columna, opcion, pedidos in (('bolsa', '--exchange', bolsas), ('sector', '--sector', sectores)):
+        validos = empresas.valores(columna) if pedidos else []
+        for valor in pedidos:
+            if valor.lower() not in (v.lower() for v in validos):
+                parser.error('unknown value in ' + opcion + ': ' + valor + ' (one of ' + ', '.join(validos) + ')')
+    for ticker in [ args.n ] if args.n else [ t.strip() for t in (args.tickers or '').split(',') if t.strip() ]:
+        if ticker not in empresas:
+            parser.error(str(TickerDesconocido(ticker, empresas.parecidos(ticker))))
+    filtros = [ c.strip() for c in (args.filters or '').split(',') if c.strip() ]
+    for criterio in filtros:
+        if criterio not in hojas_criterio or criterio == 'rentabilidad':
+            parser.error('unknown criterion in --filters: ' + criterio)
+    if args.filters is not None and args.period == 'both':
+        parser.error('--filters screens one period type at a time')
+    if args.watch and (args.period == 'both' or args.filters is not None):
+        parser.error('--watch takes neither --period both nor --filters')
+    cache_http.offline = args.offline
+    if args.profile:
+        perfil.activar()
+    if args.base_url:
+        usar_base_url(args.base_url)
+    cliente_http.timeout = args.timeout
+    cliente_http.max_conexiones = args.max_connections
+    politica_descarga.reintentos = args.retries
+    politica_descarga.plazo = args.deadline
+    politica_descarga.tasa = args.rate
+    politica_descarga.tasa_maxima = args.max_rate
+    motor_html = args.parser
+
+    if args.search is not None:
+        for e in empresas.buscar(args.search):
+            print(e.ticker.ljust(14) + e.pair_id.ljust(10) + e.bolsa.ljust(10) + e.moneda.ljust(6) + e.sector.ljust(22) + e.slug)
+        sys.exit(0)
+
+    if args.all or args.tickers:
+        tickers = empresas.seleccionar(bolsas, sectores, None if args.all else [ t.strip() for t in args.tickers.split(',') if t.strip() ])
+        if not tickers:
+            sys.exit('ninguna empresa del registro cumple --exchange y --sector')
+
+    if args.watch:
+        tickers = [ args.n ] if args.n else tickers
+        vigilante = Vigilante(tickers, args.interval, args.period, 5, args.workers, args.cycles)
+        print('vigilando ' + str(len(tickers)) + ' empresas, precio cada ' + str(args.interval) + ' s (ctrl-c para terminar)')
+        try:
+            for evento in cliente_http.iterar(vigilante.eventos):
+                with candado_salida:
+                    print(evento, flush=True)
+        except KeyboardInterrupt:
+            pass
+        m = vigilante.metricas()
+        print(str(m['empresas']) + ' empresas, ' + str(m['ciclos']) + ' ciclos, ' + str(m['consultas']) + ' consultas de precio, '
+            + str(m['recalculos']) + ' recalculos, ' + str(m['con_error']) + ' con error')
+        reportar_perfil(args.profile)
+        sys.exit(0)
+
+    if args.all or args.tickers:
+        if args.filters is not None:
+            # cada empresa se imprime apenas termina
+            filtrado = ScreenerFiltrado(tickers, filtros, args.period, 5, args.workers, args.charts, args.chart_format)
+            resultados = {}
+            imprimir_encabezado()
+            for r in cliente_http.iterar(filtrado.resultados):
+                resultados[r.ticker] = r
+                with candado_salida:
+                    imprimir_fila(r.ticker, r)
+            imprimir_leyenda()
+            imprimir_metricas()
+            m = filtrado.metricas()
+            print('filtros: ' + str(sum(m['descartadas'].values())) + ' de ' + str(m['empresas']) + ' empresas descartadas ('
+                + ', '.join(c + ': ' + str(k) for c, k in m['descartadas'].items()) + '), ' + str(m['documentos_pedidos'])
+                + ' documentos pedidos, ' + str(m['documentos_ahorrados']) + ' ahorrados (' + str(m['ahorro_pct'])
+                + ' %), primer resultado en ' + str(m['primer_resultado_s']) + ' s, total ' + str(m['total_s']) + ' s')
+        else:
+            period_type = ('Annual', 'Interim') if args.period == 'both' else args.period
+            resultados = cliente_http.ejecutar(lambda client: screener(tickers, period_type, 5, args.workers, args.charts,
+                args.chart_format, client, args.parse_workers, args.parse_queue))
+            imprimir_resumen(resultados)
+        if args.export:
+            exportar(resultados.values(), args.export)
+        reportar_perfil(args.profile)
+        sys.exit(0)
+
+    b = Estados(args.n, args.period, 5, historico=args.history)
+    # el analisis completo usa todos los campos: se descargan todos los documentos en paralelo
+    try:
+        b.resolver()
+    except (ErrorDescarga, ErrorDocumento) as e:
+        print(Fore.RED + 'error -> ' + type(e).__name__ + ': ' + str(e) + Style.RESET_ALL)
+        sys.exit(1)
 
     # --------------------------------------------------------------------------------------------------------------------
     # a) Balance  (fotografía de la empresa)
@@ -807,12 +3384,12 @@ if __name__=="__main__":
     print('')
 
     print('razon crecimiento activos totales:')
-    razonCrecimientoActivos = razon_crecimiento(activosTotales)
+    razonCrecimientoActivos = b.crecimiento('activos_totales')
     print(razonCrecimientoActivos)
     print('')
 
     print('razon crecimiento activos circulantes:')
-    razonActivoCirculante = razon_crecimiento(totalActivoCirculante)
+    razonActivoCirculante = b.crecimiento('total_activo_circulante')
     print(razonActivoCirculante)
     print('')
 
@@ -822,7 +3399,7 @@ if __name__=="__main__":
     print('')
 
     print('razon crecimiento patrimonio:')
-    razonPatrimonio = razon_crecimiento(patrimonioNeto)
+    razonPatrimonio = b.crecimiento('patrimonio_neto')
     print(razonPatrimonio)
     print('')
 
@@ -832,7 +3409,7 @@ if __name__=="__main__":
     print('')
 
     print('razon crecimiento acciones:')
-    razonAcciones = razon_crecimiento(acciones)
+    razonAcciones = b.crecimiento('acciones_circulando')
     print(razonAcciones)
     print('')
 
@@ -892,7 +3469,7 @@ if __name__=="__main__":
     print(totalIngresos)
     print('')
 
-    razonIngresos = razon_crecimiento(totalIngresos)
+    razonIngresos = b.crecimiento('total_ingresos')
 
     print('razon ingresos:')
     print(razonIngresos)
@@ -908,7 +3485,7 @@ if __name__=="__main__":
     print(totalMargenBruto)
     print('')
 
-    razonMargenBruto = razon_crecimiento(totalMargenBruto)
+    razonMargenBruto = b.crecimiento('total_margen_bruto')
 
     print('razon margen bruto:')
     print(razonMargenBruto)
@@ -932,7 +3509,7 @@ if __name__=="__main__":
     print('')
 
 
-    razonResultadoExplotacion = razon_crecimiento(totalResultadoExplotacion)
+    razonResultadoExplotacion = b.crecimiento('total_resultado_explotacion')
     print('razon resultado explotacion:')
     print(razonResultadoExplotacion)
     print('')
@@ -948,7 +3525,7 @@ if __name__=="__main__":
     print('')
 
     print('razon ejercicio:')
-    razonResultadoEjercicio = razon_crecimiento(totalResultadoEjercicio)
+    razonResultadoEjercicio = b.crecimiento('total_resultado_ejercicio')
     print(razonResultadoEjercicio)
     print('')
 
@@ -964,7 +3541,7 @@ if __name__=="__main__":
     print('')
 
     print('razon beneficio por accion:')
-    razonBeneficioPorAccion = razon_crecimiento(totalBeneficioPorAccion)
+    razonBeneficioPorAccion = b.crecimiento('total_beneficio_por_accion')
     print(razonBeneficioPorAccion)
     print('')
 
@@ -1115,7 +3692,7 @@ if __name__=="__main__":
     print('')
 
     print('(AC-Caja) / Ventas constante o disminuyendo? :')
-    razonCasanegra = razon_crecimiento(casanegra)
+    razonCasanegra = b.crecimiento('total_casanegra_ratio')
     print(razonCasanegra)
     check_razon_decreciente(razonCasanegra)
     print('')
@@ -1126,10 +3703,15 @@ if __name__=="__main__":
     print('')
 
     print('DPS/EPS promedio % (últimos 4 años):')
-    print(100 * round(np.mean(b.total_DPS_EPS()) ,2))
+    print(100 * round(promedio(b.total_DPS_EPS()) ,2))
+
+    if args.export:
+        exportar([ resultado_empresa(b) ], args.export)
 
     print('Gráfico amigo:')
-    b.grafico_amigo()
+    b.grafico_amigo(ruta_grafico(args.charts, b.stock_name, args.chart_format) if args.charts else None)
+
+    reportar_perfil(args.profile)
 
     #agregar multiplos cruzados (PER * B/L)
     # ROE mayor a  15%, maximo PER  sobre 22.5 es caro